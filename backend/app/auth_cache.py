@@ -0,0 +1,116 @@
+# backend/app/auth_cache.py - Verified-token and user caches for get_current_user
+#
+# Dashboards poll every 30 seconds with the same bearer token, so decoding it
+# and loading its user on every request is repeated work. Tokens are cached
+# with their verified claims until their own `exp`; user records are cached
+# for a short TTL and dropped whenever users are created or deleted (locally,
+# or by another worker via the shared "users" channel).
+
+from collections import OrderedDict
+import threading
+import time
+import os
+
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_TOKEN_CACHE_MAX_ENTRIES", "1024"))
+AUTH_USER_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_USER_CACHE_MAX_ENTRIES", "256"))
+# Upper bound on how long a user record (and its role) is trusted without the DB
+AUTH_USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", "300"))
+
+
+class _LRU:
+    """Bounded LRU of key -> (expires_at wall clock, value)"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, expires_at: float):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class AuthCache:
+    def __init__(self, token_entries: int = AUTH_TOKEN_CACHE_MAX_ENTRIES,
+                 user_entries: int = AUTH_USER_CACHE_MAX_ENTRIES,
+                 user_ttl_seconds: float = AUTH_USER_CACHE_TTL_SECONDS):
+        self._lock = threading.Lock()
+        self.tokens = _LRU(token_entries)
+        self.users = _LRU(user_entries)
+        self.user_ttl_seconds = user_ttl_seconds
+        # Bumped on every invalidation so a lookup racing with a delete is not cached
+        self.user_version = 0
+        self.invalidations = 0
+
+    # Tokens
+    def get_claims(self, token: str):
+        """Claims of a token verified earlier, or None if unknown or past its exp"""
+        with self._lock:
+            return self.tokens.get(token)
+
+    def set_claims(self, token: str, payload: dict):
+        """Cache the claims of a verified token until its exp; tokens without exp are not cached"""
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            with self._lock:
+                self.tokens.set(token, payload, float(exp))
+        return payload
+
+    # Users
+    def get_user(self, username: str):
+        with self._lock:
+            return self.users.get(username)
+
+    def set_user(self, username: str, user, version: int):
+        """Cache a user loaded while user_version was `version`"""
+        with self._lock:
+            if version == self.user_version:
+                self.users.set(username, user, time.time() + self.user_ttl_seconds)
+
+    def invalidate_users(self):
+        """Drop every cached user - called when users are created or deleted"""
+        with self._lock:
+            self.users.entries.clear()
+            self.user_version += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tokens": self.tokens.as_dict(),
+                "users": self.users.as_dict(),
+                "user_ttl_seconds": self.user_ttl_seconds,
+                "user_invalidations": self.invalidations,
+            }
+
+
+auth_cache = AuthCache()
@@ -0,0 +1,244 @@
+# backend/app/bulk_import.py - Set-based upsert engine for monthly Excel imports
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+from calendar import monthrange
+from datetime import datetime, date
+import uuid
+import os
+
+from .models import Truck
+from . import stats_rollup
+from .duplicate_index import duplicate_index, natural_key
+from .change_feed import next_version
+
+# Rows per executemany batch
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+
+REQUIRED_FIELDS = ['terminal', 'shipping_no', 'dock_code', 'truck_route']
+UPDATABLE_FIELDS = [
+    'preparation_start', 'preparation_end', 'loading_start', 'loading_end',
+    'status_preparation', 'status_loading'
+]
+
+
+def _month_bounds(year: int, month: int):
+    """Return [start, end) dates covering one calendar month"""
+    start = date(year, month, 1)
+    if month == 12:
+        end = date(year + 1, 1, 1)
+    else:
+        end = date(year, month + 1, 1)
+    return start, end
+
+
+def _chunks(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def load_existing_for_month(db: Session, terminal: str, year: int, month: int):
+    """
+    Load every truck of one terminal/month with a single range scan of the
+    natural-key index. Returns {(record_date, shipping_no, dock_code, truck_route): row dict}
+    """
+    start, end = _month_bounds(year, month)
+    rows = db.query(
+        Truck.id,
+        Truck.terminal,
+        Truck.shipping_no,
+        Truck.dock_code,
+        Truck.truck_route,
+        Truck.status_preparation,
+        Truck.status_loading,
+        Truck.created_at,
+        Truck.record_date
+    ).filter(
+        Truck.record_date >= start,
+        Truck.record_date < end,
+        Truck.terminal == terminal
+    ).order_by(Truck.created_at).all()
+
+    existing = {}
+    for row in rows:
+        key = (row.record_date, row.shipping_no, row.dock_code, row.truck_route)
+        # Keep the first match, same as the old per-day .first() lookup
+        if key not in existing:
+            existing[key] = {
+                'id': row.id,
+                'terminal': row.terminal,
+                'shipping_no': row.shipping_no,
+                'dock_code': row.dock_code,
+                'truck_route': row.truck_route,
+                'status_preparation': row.status_preparation,
+                'status_loading': row.status_loading,
+                'created_at': row.created_at,
+                'original_state': stats_rollup.truck_state(row),
+            }
+    return existing
+
+
+def expand_templates(truck_templates):
+    """
+    Expand monthly templates into daily rows grouped by (terminal, year, month).
+    Returns (groups, failed_imports)
+    """
+    groups = {}
+    failed_imports = []
+
+    for template_index, truck_template in enumerate(truck_templates):
+        try:
+            year = truck_template['year']
+            month = truck_template['month']
+            days_in_month = monthrange(year, month)[1]
+            base_shipping_no = truck_template['shipping_no']
+        except Exception as template_error:
+            failed_imports.append({
+                "template": template_index + 1,
+                "shipping_no": truck_template.get('shipping_no', 'Unknown'),
+                "error": str(template_error)
+            })
+            continue
+
+        # Required fields and dates are checked once per template but reported per day
+        error = None
+        missing = [field for field in REQUIRED_FIELDS if not truck_template.get(field)]
+        if missing:
+            error = f"Missing required field(s): {', '.join(missing)}"
+        else:
+            try:
+                # monthrange accepts years that date() does not (e.g. 10000)
+                record_dates = [date(year, month, day) for day in range(1, days_in_month + 1)]
+            except (TypeError, ValueError, OverflowError) as date_error:
+                error = str(date_error)
+        if error:
+            for day in range(1, days_in_month + 1):
+                failed_imports.append({
+                    "template": template_index + 1,
+                    "day": day,
+                    "shipping_no": base_shipping_no,
+                    "error": error
+                })
+            continue
+
+        truck_data = {field: truck_template[field] for field in REQUIRED_FIELDS}
+        for field in UPDATABLE_FIELDS:
+            truck_data[field] = truck_template.get(field)
+        truck_data['status_preparation'] = truck_data['status_preparation'] or 'On Process'
+        truck_data['status_loading'] = truck_data['status_loading'] or 'On Process'
+
+        group = groups.setdefault((truck_data['terminal'], year, month), [])
+        for day, record_date in enumerate(record_dates, start=1):
+            group.append((template_index, day, record_date, truck_data))
+
+    return groups, failed_imports
+
+
+def upsert_groups(db: Session, groups, chunk_size: int = IMPORT_CHUNK_SIZE):
+    """
+    Upsert expanded (terminal, year, month) groups in one transaction.
+
+    Existing rows are resolved in memory from one range query per group;
+    inserts and updates are then written in chunked executemany batches.
+    Returns a dict with created/updated counts and the changed rows.
+    """
+    now = datetime.utcnow()
+
+    inserts = []
+    updates = {}
+    changes = []
+
+    for (terminal, year, month), day_rows in groups.items():
+        existing = load_existing_for_month(db, terminal, year, month)
+
+        for template_index, day, record_date, truck_data in day_rows:
+            key = (record_date, truck_data['shipping_no'], truck_data['dock_code'], truck_data['truck_route'])
+            match = existing.get(key)
+
+            if match:
+                # Only time and status fields change on an exact match
+                for field in UPDATABLE_FIELDS:
+                    match[field] = truck_data[field]
+                match['updated_at'] = now
+                if 'pending_insert' not in match:
+                    updates[match['id']] = match
+                changes.append(("truck_updated", match))
+            else:
+                row = dict(truck_data)
+                row['id'] = str(uuid.uuid4())
+                row['created_at'] = datetime.combine(record_date, datetime.min.time())
+                row['record_date'] = record_date
+                row['updated_at'] = now
+                row['pending_insert'] = True
+                existing[key] = row
+                inserts.append(row)
+                changes.append(("truck_created", row))
+
+    insert_columns = ['id', 'created_at', 'record_date', 'updated_at', 'row_version'] + REQUIRED_FIELDS + UPDATABLE_FIELDS
+    update_columns = ['id', 'updated_at', 'row_version'] + UPDATABLE_FIELDS
+
+    # Rollup deltas are computed from final row states, once per (day, terminal)
+    rollup_deltas = {}
+    for row in inserts:
+        stats_rollup.add_to_deltas(rollup_deltas, stats_rollup.truck_state(row))
+    for row in updates.values():
+        stats_rollup.add_to_deltas(rollup_deltas, row['original_state'], sign=-1)
+        stats_rollup.add_to_deltas(rollup_deltas, stats_rollup.truck_state(row))
+
+    try:
+        # One dataset version for the whole transaction (change feed)
+        version = next_version(db) if inserts or updates else None
+        for row in inserts:
+            row['row_version'] = version
+        for row in updates.values():
+            row['row_version'] = version
+        for chunk in _chunks(inserts, chunk_size):
+            db.execute(insert(Truck), [{col: row[col] for col in insert_columns} for row in chunk])
+        for chunk in _chunks(list(updates.values()), chunk_size):
+            db.execute(update(Truck), [{col: row[col] for col in update_columns} for row in chunk])
+        stats_rollup.apply_deltas(db, rollup_deltas)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    # Updates match on the natural key, so only inserts add keys
+    duplicate_index.apply(added=[natural_key(row) for row in inserts])
+
+    return {
+        "created": len(inserts),
+        "updated": len(changes) - len(inserts),
+        "changes": changes,
+    }
+
+
+def bulk_upsert_templates(db: Session, truck_templates, chunk_size: int = IMPORT_CHUNK_SIZE):
+    """
+    Expand monthly templates into daily trucks and upsert them, one transaction
+    per (terminal, year, month) group. A group that fails is rolled back and
+    its rows are reported in failed_details; the other groups still import.
+    Returns a dict with created/updated counts, failed_details and the changed rows.
+    """
+    groups, failed_imports = expand_templates(truck_templates)
+    result = {"created": 0, "updated": 0, "changes": []}
+
+    for group_key, day_rows in groups.items():
+        try:
+            group_result = upsert_groups(db, {group_key: day_rows}, chunk_size)
+        except Exception as group_error:
+            db.rollback()
+            print(f"❌ Import of {group_key[0]} {group_key[1]}-{group_key[2]:02d} failed: {group_error}")
+            for template_index, day, _, truck_data in day_rows:
+                failed_imports.append({
+                    "template": template_index + 1,
+                    "day": day,
+                    "shipping_no": truck_data['shipping_no'],
+                    "error": str(group_error)
+                })
+            continue
+        result["created"] += group_result["created"]
+        result["updated"] += group_result["updated"]
+        result["changes"].extend(group_result["changes"])
+
+    result["failed_details"] = failed_imports
+    return result
@@ -0,0 +1,176 @@
+# backend/app/change_feed.py - Versioned change feed for /api/trucks/changes
+#
+# Every truck write transaction takes the next dataset version and stamps it
+# on the rows it writes (trucks.row_version) or on a tombstone for deleted
+# trucks. Clients keep a local copy and ask for everything after the last
+# version they saw. The version row is updated inside the write transaction,
+# so on SQLite (single writer) versions become visible in commit order.
+#
+# The current version is also held in process (dataset_version) so read
+# endpoints can answer conditional GETs without a query; other workers'
+# writes arrive as shared-state events and mark it stale, and it is re-read
+# after DATASET_VERSION_MAX_AGE_SECONDS in case such an event was lost.
+
+from sqlalchemy import update, event
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+import threading
+import time
+import os
+
+from .models import Truck, TruckTombstone, DatasetVersion
+from .serialization import truck_select
+
+CHANGE_FEED_DEFAULT_LIMIT = 1000
+CHANGE_FEED_MAX_LIMIT = int(os.getenv("CHANGE_FEED_MAX_LIMIT", "5000"))
+# Clients further behind than this get reset=true and reload the full list
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+# Longest a worker trusts its cached version without reading the row
+DATASET_VERSION_MAX_AGE_SECONDS = float(os.getenv("DATASET_VERSION_MAX_AGE_SECONDS", "1"))
+
+
+def next_version(db: Session) -> int:
+    """Take the next dataset version for the current write transaction"""
+    modified_at = datetime.utcnow()
+    db.execute(
+        update(DatasetVersion).where(DatasetVersion.id == 1).values(
+            version=DatasetVersion.version + 1, modified_at=modified_at
+        )
+    )
+    version = db.query(DatasetVersion.version).filter(DatasetVersion.id == 1).scalar()
+    # Published to this worker's tracker once the transaction commits
+    event.listen(db, "after_commit", lambda session: dataset_version.observe(version, modified_at), once=True)
+    return version
+
+
+def load_version(db: Session):
+    """(version, modified_at) as stored"""
+    row = db.query(DatasetVersion.version, DatasetVersion.modified_at).filter(DatasetVersion.id == 1).first()
+    return (row.version, row.modified_at) if row else (0, None)
+
+
+class DatasetVersionTracker:
+    """This worker's view of the dataset version, for ETag/Last-Modified"""
+
+    def __init__(self, max_age_seconds: float = DATASET_VERSION_MAX_AGE_SECONDS):
+        self._lock = threading.Lock()
+        self.max_age_seconds = max_age_seconds
+        self.version = None
+        self.modified_at = None
+        self.loaded_at = 0.0
+        # Bumped by invalidate() so a load racing with another worker's write is not installed
+        self.generation = 0
+        self.loads = 0
+
+    def _install(self, version: int, modified_at):
+        if self.version is None or version > self.version:
+            self.version, self.modified_at = version, modified_at
+        self.loaded_at = time.monotonic()
+
+    def observe(self, version: int, modified_at):
+        """Record a version this worker committed"""
+        with self._lock:
+            self._install(version, modified_at)
+
+    def invalidate(self):
+        """Another worker wrote; reload on next use"""
+        with self._lock:
+            self.version = None
+            self.generation += 1
+
+    async def current(self, run_db):
+        """(version, modified_at), loaded through run_db only when stale"""
+        with self._lock:
+            if self.version is not None and time.monotonic() - self.loaded_at < self.max_age_seconds:
+                return self.version, self.modified_at
+            generation = self.generation
+        version, modified_at = await run_db(load_version)
+        with self._lock:
+            self.loads += 1
+            if generation == self.generation:
+                self._install(version, modified_at)
+        return version, modified_at
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "max_age_seconds": self.max_age_seconds,
+                "loads": self.loads,
+                "invalidations": self.generation,
+            }
+
+
+dataset_version = DatasetVersionTracker()
+
+
+def record_delete(db: Session, truck_id: str, version: int):
+    db.merge(TruckTombstone(truck_id=truck_id, version=version, deleted_at=datetime.utcnow()))
+
+
+def prune_tombstones(db: Session, retention_days: int = TOMBSTONE_RETENTION_DAYS) -> int:
+    """Drop old tombstones and remember the newest version dropped"""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    old = db.query(TruckTombstone).filter(TruckTombstone.deleted_at < cutoff)
+    pruned_through = db.query(TruckTombstone.version).filter(
+        TruckTombstone.deleted_at < cutoff
+    ).order_by(TruckTombstone.version.desc()).limit(1).scalar()
+    if pruned_through is None:
+        return 0
+    removed = old.delete(synchronize_session=False)
+    db.query(DatasetVersion).filter(
+        DatasetVersion.id == 1, DatasetVersion.pruned_through < pruned_through
+    ).update({DatasetVersion.pruned_through: pruned_through}, synchronize_session=False)
+    db.commit()
+    return removed
+
+
+def changes_since(db: Session, since: int, limit: int = CHANGE_FEED_DEFAULT_LIMIT):
+    """
+    Trucks written (truck_select() rows plus row_version) and ids deleted
+    after `since`, oldest version first.
+    A page always ends on a complete version; pass the returned `version` as
+    the next `since` while has_more is true.
+    """
+    state = db.query(DatasetVersion.version, DatasetVersion.pruned_through).filter(DatasetVersion.id == 1).first()
+    current, pruned_through = state if state else (0, 0)
+
+    if since < pruned_through or since > current:
+        # Deletes the client missed are gone (or the dataset was replaced)
+        return {"version": current, "reset": True, "has_more": False, "trucks": [], "deleted": []}
+
+    def fetch(upto, page_limit=None):
+        trucks = truck_select().add_columns(Truck.row_version).where(
+            Truck.row_version > since, Truck.row_version <= upto
+        ).order_by(Truck.row_version, Truck.id)
+        deleted = db.query(TruckTombstone.truck_id, TruckTombstone.version).filter(
+            TruckTombstone.version > since, TruckTombstone.version <= upto
+        ).order_by(TruckTombstone.version)
+        if page_limit is not None:
+            trucks, deleted = trucks.limit(page_limit + 1), deleted.limit(page_limit + 1)
+        return db.execute(trucks).all(), deleted.all()
+
+    trucks, deleted = fetch(current, limit)
+
+    # Versions past the first row that did not fit are left for the next page
+    cut_versions = []
+    if len(trucks) > limit:
+        cut_versions.append(trucks[limit].row_version)
+    if len(deleted) > limit:
+        cut_versions.append(deleted[limit].version)
+    upto = current
+    if cut_versions:
+        first_cut = min(cut_versions)
+        upto = first_cut - 1
+        if upto <= since:
+            # One version holds more than a page (a bulk import): return all of it
+            upto = first_cut
+            trucks, deleted = fetch(upto)
+
+    return {
+        "version": upto,
+        "reset": False,
+        "has_more": upto < current,
+        "trucks": [truck for truck in trucks if truck.row_version <= upto],
+        "deleted": [truck_id for truck_id, version in deleted if version <= upto],
+    }
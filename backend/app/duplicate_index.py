@@ -0,0 +1,143 @@
+# backend/app/duplicate_index.py - In-memory natural-key index for duplicate checks
+#
+# Answers /api/trucks/duplicate-stats and "would this update or create?" without
+# scanning trucks. Counters are loaded once, month key sets on first use; both
+# are then updated by this worker's writes. Writes made by other workers arrive
+# as shared-state events, which simply drop the index so it reloads lazily.
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from collections import Counter
+from datetime import date
+import threading
+
+from .models import Truck
+
+NATURAL_KEY_FIELDS = ['record_date', 'terminal', 'shipping_no', 'dock_code', 'truck_route']
+
+
+def natural_key(truck):
+    """(record_date, terminal, shipping_no, dock_code, truck_route) of a dict, ORM object or Row"""
+    get = truck.get if isinstance(truck, dict) else lambda key: getattr(truck, key)
+    return tuple(get(field) for field in NATURAL_KEY_FIELDS)
+
+
+class DuplicateIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Bumped on every change so a load racing with a write is not installed
+        self.version = 0
+        self._reset()
+        self.loads = 0
+        self.invalidations = 0
+
+    def _reset(self):
+        self.counters_loaded = False
+        self.dock_counts = Counter()
+        self.shipping_counts = Counter()
+        self.total = 0
+        # (year, month) -> Counter of natural keys; a count > 1 only exists on
+        # databases still running with the non-unique fallback index
+        self.months = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._reset()
+            self.version += 1
+            self.invalidations += 1
+
+    # Writes
+    def apply(self, removed=(), added=()):
+        """Record committed changes as lists of natural keys"""
+        with self._lock:
+            self.version += 1
+            for key, sign in [(key, -1) for key in removed] + [(key, 1) for key in added]:
+                record_date, _, shipping_no, dock_code, _ = key
+                if self.counters_loaded:
+                    self.total += sign
+                    self.dock_counts[dock_code] += sign
+                    self.shipping_counts[shipping_no] += sign
+                month_keys = self.months.get((record_date.year, record_date.month)) if record_date else None
+                if month_keys is not None:
+                    month_keys[key] += sign
+                    if month_keys[key] <= 0:
+                        del month_keys[key]
+
+    # Loading
+    def _load_counters(self, db: Session):
+        version = self.version
+        dock_counts = Counter(dict(db.query(Truck.dock_code, func.count(Truck.id)).group_by(Truck.dock_code).all()))
+        shipping_counts = Counter(dict(db.query(Truck.shipping_no, func.count(Truck.id)).group_by(Truck.shipping_no).all()))
+        total = sum(dock_counts.values())
+        with self._lock:
+            if version == self.version and not self.counters_loaded:
+                self.dock_counts, self.shipping_counts, self.total = dock_counts, shipping_counts, total
+                self.counters_loaded = True
+                self.loads += 1
+        return dock_counts, shipping_counts, total
+
+    def _load_month(self, db: Session, year: int, month: int):
+        start = date(year, month, 1)
+        end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        version = self.version
+        rows = db.query(*[getattr(Truck, field) for field in NATURAL_KEY_FIELDS]).filter(
+            Truck.record_date >= start,
+            Truck.record_date < end
+        ).all()
+        month_keys = Counter(tuple(row) for row in rows)
+        with self._lock:
+            if version == self.version and (year, month) not in self.months:
+                self.months[(year, month)] = month_keys
+                self.loads += 1
+        return month_keys
+
+    # Queries
+    def duplicate_stats(self, db: Session):
+        """Same shape as the old GROUP BY ... HAVING count > 1 statistics"""
+        with self._lock:
+            if self.counters_loaded:
+                dock_counts, shipping_counts, total = Counter(self.dock_counts), Counter(self.shipping_counts), self.total
+            else:
+                dock_counts = None
+        if dock_counts is None:
+            dock_counts, shipping_counts, total = self._load_counters(db)
+
+        return {
+            "dock_code_duplicates": [
+                {"dock_code": dock_code, "count": count}
+                for dock_code, count in sorted(dock_counts.items()) if count > 1
+            ],
+            "shipping_no_duplicates": [
+                {"shipping_no": shipping_no, "count": count}
+                for shipping_no, count in sorted(shipping_counts.items()) if count > 1
+            ],
+            "total_records": total
+        }
+
+    def contains(self, db: Session, key) -> bool:
+        """Whether a truck with this natural key exists"""
+        record_date = key[0]
+        with self._lock:
+            month_keys = self.months.get((record_date.year, record_date.month))
+            if month_keys is not None:
+                return key in month_keys
+        return key in self._load_month(db, record_date.year, record_date.month)
+
+    def rebuild(self, db: Session):
+        """Drop everything and reload the counters now; month sets reload on use"""
+        self.invalidate()
+        self._load_counters(db)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "counters_loaded": self.counters_loaded,
+                "months_loaded": len(self.months),
+                "keys_loaded": sum(len(keys) for keys in self.months.values()),
+                "total_records": self.total if self.counters_loaded else None,
+                "loads": self.loads,
+                "invalidations": self.invalidations,
+            }
+
+
+duplicate_index = DuplicateIndex()
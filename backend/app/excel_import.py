@@ -0,0 +1,558 @@
+# backend/app/excel_import.py - Column-wise parsing of monthly import workbooks
+#
+# The only module that uses pandas/numpy/openpyxl. They are imported inside the
+# functions that need them, so API workers never load them; parsing runs in
+# the Excel process pool, which pays the import once per pool process.
+
+from calendar import monthrange
+from datetime import datetime
+import threading
+import tempfile
+import hashlib
+import shutil
+import math
+import io
+import os
+
+# pandas' default na_values (STR_NA_VALUES)
+NA_STRINGS = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+              '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+
+# Rows parsed per chunk when reading an upload
+IMPORT_READ_CHUNK_ROWS = int(os.getenv("IMPORT_READ_CHUNK_ROWS", "5000"))
+UPLOAD_COPY_BYTES = 1024 * 1024
+# Browser/proxy cache lifetime of the import template; after that it is revalidated by ETag
+IMPORT_TEMPLATE_MAX_AGE = int(os.getenv("IMPORT_TEMPLATE_MAX_AGE", "86400"))
+
+REQUIRED_COLUMNS = {
+    'Month': 'month',
+    'Terminal': 'terminal',
+    'Shipping No': 'shipping_no',
+    'Dock Code': 'dock_code',
+    'Route': 'truck_route'
+}
+
+OPTIONAL_COLUMNS = {
+    'Prep Start': 'preparation_start',
+    'Prep End': 'preparation_end',
+    'Load Start': 'loading_start',
+    'Load End': 'loading_end',
+    'Status Prep': 'status_preparation',
+    'Status Load': 'status_loading'
+}
+
+TIME_FIELDS = ['preparation_start', 'preparation_end', 'loading_start', 'loading_end']
+VALID_STATUSES = ['On Process', 'Delay', 'Finished']
+
+# YYYY-MM with int()-style parts: optional whitespace and leading '+'
+MONTH_PATTERN = r'^\s*(\+?\d+)\s*-\s*(\+?\d+)\s*$'
+# HH:MM[:...] with int()-style hour and minute parts
+TIME_PATTERN = r'^\s*([+-]?\d+)\s*:\s*([+-]?\d+)\s*(?::[\s\S]*)?$'
+
+
+def is_missing(value) -> bool:
+    """Scalar pd.isna() without pandas: None, NaN floats, NaT and pd.NA"""
+    if value is None:
+        return True
+    if isinstance(value, float):
+        return math.isnan(value)
+    return type(value).__name__ in ('NaTType', 'NAType')
+
+
+def format_time_value(value):
+    """Convert a single Excel time value to HH:MM format (fallback for uncommon types)"""
+    if is_missing(value) or value == '':
+        return None
+
+    try:
+        # If it's already a string
+        if isinstance(value, str):
+            value = value.strip()
+            if not value:
+                return None
+            # Check HH:MM format
+            if ':' in value:
+                parts = value.split(':')
+                if len(parts) >= 2:
+                    hours = int(parts[0])
+                    minutes = int(parts[1])
+                    return f"{hours:02d}:{minutes:02d}"
+            return value
+
+        # If it's a number (Excel time format: 0.5 = 12:00)
+        if isinstance(value, (int, float)):
+            # Excel stores time as decimal fraction of a day
+            total_minutes = int(value * 24 * 60)
+            hours = total_minutes // 60
+            minutes = total_minutes % 60
+            return f"{hours:02d}:{minutes:02d}"
+
+        # If it's a datetime object
+        if hasattr(value, 'hour') and hasattr(value, 'minute'):
+            return f"{value.hour:02d}:{value.minute:02d}"
+
+        # Try to convert to string and process
+        str_value = str(value).strip()
+        if ':' in str_value:
+            parts = str_value.split(':')
+            if len(parts) >= 2:
+                hours = int(float(parts[0]))
+                minutes = int(float(parts[1]))
+                return f"{hours:02d}:{minutes:02d}"
+
+        print(f"⚠️ Could not format time value: {value} (type: {type(value)})")
+        return None
+
+    except Exception as e:
+        print(f"❌ Time formatting error: {e}, Value: {value}")
+        return None
+
+
+def _format_hours_minutes(hours: "pd.Series", minutes: "pd.Series") -> "pd.Series":
+    """Vectorized f"{hours:02d}:{minutes:02d}" for integer series"""
+    def pad(values):
+        text = values.abs().astype(str).str.zfill(2)
+        return text.where(values >= 0, '-' + values.abs().astype(str).str.zfill(1))
+    return pad(hours) + ':' + pad(minutes)
+
+
+def _format_time_numbers(values: "pd.Series") -> "pd.Series":
+    """Excel day fractions (0.5 = 12:00) to HH:MM; non-finite values become None"""
+    import numpy as np
+    import pandas as pd
+
+    minutes_float = values.astype(float) * 24 * 60
+    finite = np.isfinite(minutes_float)
+    result = pd.Series([None] * len(values), index=values.index, dtype=object)
+    if finite.any():
+        total_minutes = np.trunc(minutes_float[finite]).astype(np.int64)
+        result[finite] = _format_hours_minutes(total_minutes // 60, total_minutes % 60)
+    return result
+
+
+def _format_time_strings(values: "pd.Series") -> "pd.Series":
+    """Strings: HH:MM normalized, other non-empty text passed through, bad HH:MM dropped"""
+    import numpy as np
+
+    stripped = values.str.strip()
+    result = stripped.where(stripped != '', None).astype(object)
+
+    has_colon = stripped.str.contains(':', regex=False)
+    if has_colon.any():
+        parts = stripped[has_colon].str.extract(TIME_PATTERN)
+        parsed = parts[0].notna()
+        formatted = _format_hours_minutes(
+            parts.loc[parsed, 0].astype(np.int64),
+            parts.loc[parsed, 1].astype(np.int64)
+        )
+        result.loc[has_colon[has_colon].index] = None
+        result.loc[formatted.index] = formatted
+    return result
+
+
+def _map_unique(column: "pd.Series", func, missing=None) -> "pd.Series":
+    """
+    Apply a Series -> Series conversion to the distinct non-null values only
+    and broadcast back; template columns repeat the same few values per month.
+    """
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(column)
+    lookup = np.empty(len(uniques) + 1, dtype=object)
+    lookup[-1] = missing  # code -1 marks missing values
+    if len(uniques):
+        mapped = func(pd.Series(uniques)).astype(object)
+        lookup[:-1] = mapped.where(mapped.notna(), None).to_numpy(dtype=object)
+    return pd.Series(lookup[codes], index=column.index, dtype=object)
+
+
+def _normalize_time_values(values: "pd.Series") -> "pd.Series":
+    """HH:MM strings for non-null time values of any Excel cell type"""
+    import numpy as np
+    import pandas as pd
+
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_numeric_dtype(values):
+        return _format_time_numbers(values)
+
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return _format_hours_minutes(values.dt.hour.astype(np.int64), values.dt.minute.astype(np.int64))
+
+    result = pd.Series([None] * len(values), index=values.index, dtype=object)
+    is_string = values.map(type) == str
+    if is_string.any():
+        result[is_string] = _format_time_strings(values[is_string].astype(object))
+
+    is_number = values.map(lambda value: isinstance(value, (int, float, np.number)))
+    if is_number.any():
+        result[is_number] = _format_time_numbers(values[is_number])
+
+    # Datetimes, times and anything unusual take the scalar path
+    other = ~(is_string | is_number)
+    if other.any():
+        result[other] = values[other].map(format_time_value)
+
+    return result.where(result.notna(), None)
+
+
+def normalize_time_column(column: "pd.Series") -> "pd.Series":
+    """Normalize a whole time column to HH:MM strings (None for blanks)"""
+    return _map_unique(column, _normalize_time_values)
+
+
+def _stripped_text(column: "pd.Series") -> "pd.Series":
+    """str(value).strip() for present values, '' for missing ones"""
+    return _map_unique(column, lambda values: values.map(str).str.strip(), missing='')
+
+
+def parse_import_dataframe(df: "pd.DataFrame", first_row_number: int = 2):
+    """
+    Validate and convert monthly template rows column-wise.
+    Returns (truck_templates, errors, total_records_to_create); errors keep the
+    per-row "Row N: ..." messages in row order.
+    """
+    import numpy as np
+    import pandas as pd
+
+    df = df.reset_index(drop=True)
+    row_numbers = np.arange(len(df)) + first_row_number
+    errors = []  # (row position, column order, message)
+
+    # Month parsing
+    month_text = _stripped_text(df['Month'])
+    month_missing = month_text == ''
+    month_codes, month_uniques = pd.factorize(month_text)
+    month_parts = pd.Series(month_uniques, dtype=object).str.extract(MONTH_PATTERN)
+    years = pd.Series(pd.to_numeric(month_parts[0], errors='coerce').to_numpy()[month_codes])
+    months = pd.Series(pd.to_numeric(month_parts[1], errors='coerce').to_numpy()[month_codes])
+    month_valid = ~month_missing & years.notna() & months.between(1, 12)
+
+    for position in np.flatnonzero(month_missing):
+        errors.append((position, 0, f"Row {row_numbers[position]}: Month is required"))
+    for position in np.flatnonzero(~month_missing & ~month_valid):
+        errors.append((position, 0, f"Row {row_numbers[position]}: Month must be in format YYYY-MM (e.g., 2024-01)"))
+
+    # Required text columns (rows missing a value are reported but still kept)
+    required_values = {}
+    required_present = {}
+    for order, (excel_col, db_col) in enumerate(REQUIRED_COLUMNS.items()):
+        if excel_col == 'Month':
+            continue
+        text = _stripped_text(df[excel_col])
+        present = text != ''
+        required_values[db_col] = text
+        required_present[db_col] = present
+        for position in np.flatnonzero(month_valid & ~present):
+            errors.append((position, order, f"Row {row_numbers[position]}: {excel_col} is required"))
+
+    # Optional columns
+    optional_values = {}
+    for excel_col, db_col in OPTIONAL_COLUMNS.items():
+        if db_col in TIME_FIELDS:
+            optional_values[db_col] = (
+                normalize_time_column(df[excel_col]) if excel_col in df.columns
+                else pd.Series([None] * len(df), index=df.index, dtype=object)
+            )
+        else:
+            text = _stripped_text(df[excel_col]) if excel_col in df.columns else pd.Series('', index=df.index, dtype=object)
+            optional_values[db_col] = text.where(text.isin(VALID_STATUSES), 'On Process')
+
+    # Days per distinct (year, month) instead of per row
+    valid_positions = np.flatnonzero(month_valid)
+    valid_years = years.iloc[valid_positions].astype(np.int64).tolist()
+    valid_months = months.iloc[valid_positions].astype(np.int64).tolist()
+    days_lookup = {pair: monthrange(*pair)[1] for pair in set(zip(valid_years, valid_months))}
+
+    truck_templates = []
+    total_records_to_create = 0
+    required_lists = {db_col: (values.tolist(), required_present[db_col].tolist()) for db_col, values in required_values.items()}
+    optional_lists = {db_col: values.tolist() for db_col, values in optional_values.items()}
+
+    for position, year, month in zip(valid_positions.tolist(), valid_years, valid_months):
+        days_in_month = days_lookup[(year, month)]
+        total_records_to_create += days_in_month
+
+        truck_template = {'year': year, 'month': month}
+        for db_col, (values, present) in required_lists.items():
+            if present[position]:
+                truck_template[db_col] = values[position]
+        for db_col, values in optional_lists.items():
+            truck_template[db_col] = values[position]
+        truck_template['preview_days'] = days_in_month
+        truck_templates.append(truck_template)
+
+    errors.sort(key=lambda error: (error[0], error[1]))
+    return truck_templates, [message for _, _, message in errors], total_records_to_create
+
+
+def _convert_cell(value, na_values):
+    """Cell value as pd.read_excel would see it: integral floats as int, NA markers as None"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value in na_values:
+        return None
+    return value
+
+
+def _header_names(cells, na_values):
+    """Column names the way pandas builds them: blanks become 'Unnamed: i', repeats get '.n'"""
+    names = []
+    seen = {}
+    for i, cell in enumerate(cells):
+        name = f"Unnamed: {i}" if cell is None or cell == '' else _convert_cell(cell, na_values)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _iter_xlsx_rows(path: str):
+    """Yield (header, row) from an .xlsx in read_only mode; trailing blank rows are dropped"""
+    from openpyxl import load_workbook
+    from openpyxl.cell.cell import ERROR_CODES
+
+    na_values = NA_STRINGS | set(ERROR_CODES)
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = _header_names(next(rows, ()), na_values)
+        yield header, None
+
+        width = len(header)
+        blank_run = []
+        for values in rows:
+            row = [_convert_cell(value, na_values) for value in values[:width]]
+            row.extend([None] * (width - len(row)))
+            if all(value is None for value in row):
+                blank_run.append(row)  # kept only if a non-blank row follows
+                continue
+            for blank in blank_run:
+                yield header, blank
+            blank_run = []
+            yield header, row
+    finally:
+        workbook.close()
+
+
+def _iter_row_chunks(path: str, chunk_rows: int):
+    """Yield (columns, DataFrame) chunks of at most chunk_rows rows"""
+    import pandas as pd
+
+    if path.lower().endswith('.csv'):
+        reader = pd.read_csv(path, dtype=object, chunksize=chunk_rows)
+        for chunk in reader:
+            yield list(chunk.columns), chunk.astype(object).where(chunk.notna(), None)
+        return
+
+    if path.lower().endswith('.xls'):
+        # Legacy format: no streaming reader, load it whole
+        df = pd.read_excel(path)
+        yield list(df.columns), df
+        return
+
+    header = None
+    buffer = []
+    for header, row in _iter_xlsx_rows(path):
+        if row is None:
+            continue
+        buffer.append(row)
+        if len(buffer) >= chunk_rows:
+            yield header, pd.DataFrame(buffer, columns=header, dtype=object)
+            buffer = []
+    if header is not None:
+        yield header, pd.DataFrame(buffer, columns=header, dtype=object)
+
+
+def read_import_file(path: str, chunk_rows: int = IMPORT_READ_CHUNK_ROWS):
+    """
+    Read and parse a spooled upload chunk by chunk so peak memory is bounded by
+    chunk_rows, not the workbook size. Runs in the Excel process pool, so it
+    takes and returns plain picklable values only.
+    """
+    columns = []
+    truck_templates = []
+    errors = []
+    total_records_to_create = 0
+    rows_read = 0
+
+    for columns, chunk in _iter_row_chunks(path, chunk_rows):
+        missing_columns = [col for col in REQUIRED_COLUMNS.keys() if col not in columns]
+        if missing_columns:
+            return {'columns': columns, 'missing_columns': missing_columns}
+
+        chunk_templates, chunk_errors, chunk_total = parse_import_dataframe(chunk, first_row_number=rows_read + 2)
+        truck_templates.extend(chunk_templates)
+        errors.extend(chunk_errors)
+        total_records_to_create += chunk_total
+        rows_read += len(chunk)
+
+    if not columns:
+        return {'columns': [], 'missing_columns': list(REQUIRED_COLUMNS.keys())}
+
+    return {
+        'columns': columns,
+        'missing_columns': [],
+        'truck_templates': truck_templates,
+        'errors': errors,
+        'total_records_to_create': total_records_to_create
+    }
+
+
+def spool_upload(fileobj, filename: str) -> str:
+    """Copy an upload to a temp file in fixed-size blocks; returns its path"""
+    suffix = os.path.splitext(filename)[1].lower()
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix='import_')
+    with os.fdopen(fd, 'wb') as out:
+        fileobj.seek(0)
+        shutil.copyfileobj(fileobj, out, UPLOAD_COPY_BYTES)
+    return path
+
+
+TEMPLATE_CREATED = datetime(2024, 1, 1)
+_template_lock = threading.Lock()
+_template = None
+
+
+def build_import_template() -> bytes:
+    """Excel template with flexible duplicate examples (.xlsx bytes), written with xlsxwriter"""
+    import xlsxwriter
+
+    # ✅ UPDATED: Template data showing duplicate examples
+    template_data = {
+        'Month': ['2024-01', '2024-01', '2024-02', '2024-02'],
+        'Terminal': ['A', 'A', 'B', 'B'], 
+        'Shipping No': ['SHP001', 'SHP002', 'SHP001', 'SHP001'],
+        'Dock Code': ['DOCK-A1', 'DOCK-A1', 'DOCK-B1', 'DOCK-B2'],  # Same dock allowed
+        'Route': ['Bangkok-Chonburi', 'Bangkok-Rayong', 'Bangkok-Chonburi', 'Bangkok-Chonburi'],  # Same route allowed
+        'Prep Start': ['08:00', '09:00', '08:00', '10:00'],
+        'Prep End': ['08:30', '09:30', '08:30', '10:15'],
+        'Load Start': ['09:00', '10:00', '09:00', '11:00'],
+        'Load End': ['10:00', '11:30', '10:00', '12:45'],
+        'Status Prep': ['Finished', 'Finished', 'On Process', 'Delay'],
+        'Status Load': ['Finished', 'On Process', 'On Process', 'On Process']
+    }
+
+    columns = list(template_data.keys())
+    output = io.BytesIO()
+
+    with xlsxwriter.Workbook(output) as workbook:
+        # Fixed creation date so every build (and every worker) yields the same bytes
+        workbook.set_properties({'created': TEMPLATE_CREATED})
+        worksheet = workbook.add_worksheet('Template')
+        for row_num, row in enumerate(zip(*template_data.values()), start=1):
+            worksheet.write_row(row_num, 0, row)
+
+        # Header formatting
+        header_format = workbook.add_format({
+            'bold': True,
+            'bg_color': '#2196F3',
+            'font_color': 'white',
+            'border': 1,
+            'align': 'center'
+        })
+
+        # Time format - keep as text to prevent Excel auto-conversion
+        time_format = workbook.add_format({'num_format': '@'})
+
+        # Apply header format
+        for col_num, value in enumerate(columns):
+            worksheet.write(0, col_num, value, header_format)
+
+        # Format time columns as text (columns F, G, H, I = 5, 6, 7, 8)
+        worksheet.set_column('F:I', 12, time_format)  # Time columns
+
+        # Set other column widths
+        worksheet.set_column('A:A', 12)  # Month
+        worksheet.set_column('B:B', 12)  # Terminal
+        worksheet.set_column('C:C', 15)  # Shipping No
+        worksheet.set_column('D:D', 12)  # Dock Code
+        worksheet.set_column('E:E', 20)  # Route
+        worksheet.set_column('J:K', 12)  # Status columns
+
+        # ✅ UPDATED: Instructions sheet with flexible duplicate rules
+        instructions = workbook.add_worksheet('Instructions')
+        instructions.write('A1', 'Flexible Monthly Import Instructions:', workbook.add_format({'bold': True, 'size': 14}))
+
+        instruction_list = [
+            '',  # Empty line
+            'BASIC RULES:',
+            '1. Fill in the Template sheet with your monthly truck data',
+            '2. Required fields: Month, Terminal, Shipping No, Dock Code, Route',
+            '3. Month format: YYYY-MM (e.g., 2024-01 for January 2024)',
+            '4. Time format: HH:MM (e.g., 08:00, 14:30)',
+            '5. Valid status values: "On Process", "Delay", "Finished"',
+            '',
+            'DUPLICATE HANDLING:',
+            '6. ✅ DUPLICATES ALLOWED: Same dock codes, terminals, routes can exist',
+            '7. ✅ FLEXIBLE UPDATES: Only exact matches get updated',
+            '8. ✅ SMART CREATION: Different combinations create new records',
+            '',
+            'UPDATE CONDITIONS (ALL must match):',
+            '9. Same Date + Same Terminal + Same Shipping No + Same Dock Code + Same Route',
+            '10. Example: 2024-01-15, Terminal A, SHP001, DOCK-01, Route ABC → Updates',
+            '11. Different: 2024-01-15, Terminal A, SHP001, DOCK-02, Route ABC → New record',
+            '',
+            'MONTHLY PROCESSING:',
+            '12. Each row creates daily records for the entire month',
+            '13. Example: "2024-01" creates 31 records (Jan 1-31, 2024)',
+            '14. Time fields are copied to all daily records',
+            '15. Save file and upload through Management page'
+        ]
+
+        for i, instruction in enumerate(instruction_list):
+            cell_format = workbook.add_format({'bold': True}) if instruction.startswith(('BASIC', 'DUPLICATE', 'UPDATE', 'MONTHLY')) else None
+            instructions.write(f'A{i+3}', instruction, cell_format)
+
+        # ✅ ADD: Examples sheet
+        examples = workbook.add_worksheet('Examples')
+        examples.write('A1', 'Import Behavior Examples:', workbook.add_format({'bold': True, 'size': 14}))
+
+        example_scenarios = [
+            '',
+            'SCENARIO 1 - WILL UPDATE:',
+            'Existing: 2024-01-15 | Terminal A | SHP001 | DOCK-01 | Route ABC',
+            'Import:   2024-01-15 | Terminal A | SHP001 | DOCK-01 | Route ABC',
+            'Result:   Updates preparation/loading times and status only',
+            '',
+            'SCENARIO 2 - WILL CREATE NEW (Different Dock):',
+            'Existing: 2024-01-15 | Terminal A | SHP001 | DOCK-01 | Route ABC',
+            'Import:   2024-01-15 | Terminal A | SHP001 | DOCK-02 | Route ABC',
+            'Result:   Creates new record (dock code different)',
+            '',
+            'SCENARIO 3 - WILL CREATE NEW (Different Date):',
+            'Existing: 2024-01-15 | Terminal A | SHP001 | DOCK-01 | Route ABC',
+            'Import:   2024-01-16 | Terminal A | SHP001 | DOCK-01 | Route ABC',
+            'Result:   Creates new record (date different)',
+            '',
+            'SCENARIO 4 - DUPLICATES ALLOWED:',
+            'Multiple records can have:',
+            '- Same dock codes (DOCK-01, DOCK-01, DOCK-01)',
+            '- Same terminals (Terminal A for many records)',  
+            '- Same routes (Bangkok-Chonburi for many trucks)',
+            '- Same shipping numbers (on different dates)',
+            '',
+            'KEY POINT: Only EXACT matches (all 5 fields) get updated!'
+        ]
+
+        for i, example in enumerate(example_scenarios):
+            cell_format = workbook.add_format({'bold': True}) if example.startswith(('SCENARIO', 'KEY POINT')) else None
+            examples.write(f'A{i+3}', example, cell_format)
+
+    return output.getvalue()
+
+
+def import_template():
+    """
+    (content, etag) of the import template, built once per process.
+    The ETag is a hash of the bytes, so it only changes when the template does.
+    """
+    global _template
+    if _template is None:
+        with _template_lock:
+            if _template is None:
+                content = build_import_template()
+                _template = (content, f'"{hashlib.sha256(content).hexdigest()[:32]}"')
+    return _template
@@ -0,0 +1,178 @@
+# backend/app/executor.py - Execution model for blocking work
+#
+# The event loop only awaits. Anything that blocks runs elsewhere:
+#   - sync route handlers / dependencies: Starlette's anyio thread pool (THREADPOOL_SIZE)
+#   - blocking calls inside async handlers: run_blocking() on a bounded thread pool
+#   - CPU-heavy Excel parsing: run_cpu_bound() on a small process pool
+#   - bcrypt hashing/verification: run_password_work() on its own small pool
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import asyncio
+import time
+import os
+
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "16"))
+# 0 runs Excel parsing on the blocking thread pool instead of separate processes
+EXCEL_PROCESS_POOL_SIZE = int(os.getenv("EXCEL_PROCESS_POOL_SIZE", "1"))
+# bcrypt releases the GIL; a small pool caps the cores a login storm can take
+PASSWORD_POOL_SIZE = int(os.getenv("PASSWORD_POOL_SIZE", "2"))
+LOOP_LAG_INTERVAL_SECONDS = 0.5
+
+
+class PoolStats:
+    """Queue wait and run time counters for one pool"""
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+        self.pending = 0
+        self.completed = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.run_time_total = 0.0
+
+    def record(self, queue_wait: float, run_time: float):
+        self.completed += 1
+        self.queue_wait_total += queue_wait
+        self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+        self.run_time_total += run_time
+
+    def as_dict(self):
+        return {
+            "size": self.size,
+            "pending": self.pending,
+            "completed": self.completed,
+            "queue_wait_avg_ms": round(self.queue_wait_total / self.completed * 1000, 3) if self.completed else 0.0,
+            "queue_wait_max_ms": round(self.queue_wait_max * 1000, 3),
+            "run_time_avg_ms": round(self.run_time_total / self.completed * 1000, 3) if self.completed else 0.0,
+        }
+
+
+def _timed_call(func, submitted_at, args, kwargs):
+    """Runs inside the worker thread/process; wall clock works across processes"""
+    started_at = time.time()
+    result = func(*args, **kwargs)
+    return started_at - submitted_at, time.time() - started_at, result
+
+
+class InstrumentedPool:
+    def __init__(self, name: str, size: int, factory):
+        self.stats = PoolStats(name, size)
+        self._factory = factory
+        self._executor = None
+
+    @property
+    def executor(self):
+        # Created lazily so process pools are not spawned by workers that never import
+        if self._executor is None:
+            self._executor = self._factory()
+        return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        self.stats.pending += 1
+        try:
+            queue_wait, run_time, result = await loop.run_in_executor(
+                self.executor, _timed_call, func, time.time(), args, kwargs
+            )
+        finally:
+            self.stats.pending -= 1
+        self.stats.record(queue_wait, run_time)
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+blocking_pool = InstrumentedPool(
+    "blocking", BLOCKING_POOL_SIZE,
+    lambda: ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking")
+)
+
+# spawn, not fork: the parent holds threads, sockets and DB connections
+excel_pool = InstrumentedPool(
+    "excel", EXCEL_PROCESS_POOL_SIZE,
+    lambda: ProcessPoolExecutor(max_workers=EXCEL_PROCESS_POOL_SIZE, mp_context=multiprocessing.get_context("spawn"))
+)
+
+password_pool = InstrumentedPool(
+    "password", PASSWORD_POOL_SIZE,
+    lambda: ThreadPoolExecutor(max_workers=PASSWORD_POOL_SIZE, thread_name_prefix="bcrypt")
+)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run blocking I/O (DB session work, file access) off the event loop"""
+    return await blocking_pool.run(func, *args, **kwargs)
+
+
+async def run_cpu_bound(func, *args, **kwargs):
+    """Run CPU-heavy work (Excel parsing) in the process pool; func must be picklable"""
+    if EXCEL_PROCESS_POOL_SIZE <= 0:
+        return await blocking_pool.run(func, *args, **kwargs)
+    return await excel_pool.run(func, *args, **kwargs)
+
+
+async def run_password_work(func, *args, **kwargs):
+    """Run bcrypt hashing/verification on the dedicated password pool"""
+    return await password_pool.run(func, *args, **kwargs)
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a fixed sleep"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_SECONDS):
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - expected)
+            self.max_lag = max(self.max_lag, self.last_lag)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def as_dict(self):
+        return {
+            "last_ms": round(self.last_lag * 1000, 3),
+            "max_ms": round(self.max_lag * 1000, 3),
+        }
+
+
+loop_lag = LoopLagMonitor()
+
+
+def configure_threadpool():
+    """Size the anyio pool that runs sync route handlers and dependencies"""
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+
+def executor_stats():
+    return {
+        "threadpool_size": THREADPOOL_SIZE,
+        "blocking_pool": blocking_pool.stats.as_dict(),
+        "excel_pool": excel_pool.stats.as_dict(),
+        "password_pool": password_pool.stats.as_dict(),
+        "event_loop_lag": loop_lag.as_dict(),
+    }
+
+
+def shutdown_pools():
+    blocking_pool.shutdown()
+    excel_pool.shutdown()
+    password_pool.shutdown()
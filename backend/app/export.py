@@ -0,0 +1,84 @@
+# backend/app/export.py - Streaming CSV / XLSX export of truck rows
+
+import csv
+import io
+import os
+import tempfile
+import xlsxwriter
+
+# Same columns as the Workers backend export
+EXPORT_HEADERS = [
+    'ID',
+    'Terminal',
+    'Shipping No',
+    'Dock Code',
+    'Truck Route',
+    'Prep Start',
+    'Prep End',
+    'Loading Start',
+    'Loading End',
+    'Prep Status',
+    'Loading Status',
+    'Created Date',
+    'Updated Date'
+]
+
+# Rows buffered per CSV chunk sent to the client
+CSV_FLUSH_ROWS = 500
+XLSX_READ_CHUNK_BYTES = 64 * 1024
+
+
+def export_row(row):
+    """Map a (id, ..., created_at, updated_at) row tuple to export cells"""
+    cells = ['' if value is None else value for value in row[:11]]
+    created_at, updated_at = row[11], row[12]
+    cells.append(created_at.date().isoformat() if created_at else '')
+    cells.append(updated_at.date().isoformat() if updated_at else '')
+    return cells
+
+
+def stream_csv(rows):
+    """Yield UTF-8 CSV chunks (with BOM for Excel) as rows arrive"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_HEADERS)
+
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(export_row(row))
+        if count % CSV_FLUSH_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue().encode('utf-8')
+
+
+def stream_xlsx(rows):
+    """
+    Write rows with xlsxwriter's constant_memory mode, then stream the file.
+    An XLSX is a zip that is only complete on close(), so bytes start flowing
+    once the last row is written - memory stays bounded either way.
+    """
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+
+    try:
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('Trucks')
+        header_format = workbook.add_format({'bold': True, 'bg_color': '#2196F3', 'font_color': 'white', 'border': 1})
+
+        worksheet.write_row(0, 0, EXPORT_HEADERS, header_format)
+        for row_num, row in enumerate(rows, start=1):
+            worksheet.write_row(row_num, 0, export_row(row))
+        workbook.close()
+
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(XLSX_READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
@@ -0,0 +1,181 @@
+# backend/app/import_jobs.py - Background import jobs with progress over /ws
+#
+# A confirmed import is expanded into (terminal, month) groups and written in
+# batches by a local task, one transaction per batch. Job state lives in the
+# shared state store so any worker can report it or flag it for cancellation;
+# progress goes out on /ws as "import_progress" messages.
+
+from datetime import datetime
+import asyncio
+import uuid
+import os
+
+from .bulk_import import expand_templates, upsert_groups
+from .executor import run_blocking
+from .models import run_db_blocking
+from .response_cache import response_cache
+from .shared_state import shared_state, WORKER_ID
+
+# Imports running at once per worker (SQLite has a single writer anyway)
+IMPORT_JOB_CONCURRENCY = int(os.getenv("IMPORT_JOB_CONCURRENCY", "1"))
+# Daily rows written per transaction / progress message
+IMPORT_JOB_BATCH_ROWS = int(os.getenv("IMPORT_JOB_BATCH_ROWS", "2000"))
+# failed_details kept in the job state; the failed counter is always exact
+IMPORT_JOB_MAX_FAILED_DETAILS = int(os.getenv("IMPORT_JOB_MAX_FAILED_DETAILS", "1000"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATUSES = {JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED}
+
+PROGRESS_FIELDS = [
+    "job_id", "status", "total_rows", "rows_done", "created", "updated",
+    "failed", "cancel_requested", "error"
+]
+
+
+def progress_view(job: dict):
+    """Job state without the (possibly long) failed_details list"""
+    return {field: job.get(field) for field in PROGRESS_FIELDS}
+
+
+def _batches(groups, batch_rows):
+    """Split (terminal, year, month) groups into write batches of at most batch_rows days"""
+    for group_key, day_rows in groups.items():
+        for i in range(0, len(day_rows), batch_rows):
+            yield group_key, day_rows[i:i + batch_rows]
+
+
+class ImportJobRunner:
+    def __init__(self, manager, concurrency: int = IMPORT_JOB_CONCURRENCY, batch_rows: int = IMPORT_JOB_BATCH_ROWS):
+        self.manager = manager
+        self.concurrency = concurrency
+        self.batch_rows = batch_rows
+        self.tasks = {}
+        self._semaphore = None
+
+        # Metrics
+        self.jobs_submitted = 0
+        self.jobs_finished = {status: 0 for status in FINISHED_STATUSES}
+
+    async def submit(self, truck_templates, user_id: str, session_id: str = None):
+        """Record a queued job and start it in the background; returns the job state"""
+        groups, failed_imports = await run_blocking(expand_templates, truck_templates)
+
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "status": JOB_QUEUED,
+            "user_id": user_id,
+            "session_id": session_id,
+            "worker_id": WORKER_ID,
+            "templates": len(truck_templates),
+            "total_rows": sum(len(day_rows) for day_rows in groups.values()),
+            "rows_done": 0,
+            "created": 0,
+            "updated": 0,
+            "failed": len(failed_imports),
+            "failed_details": failed_imports[:IMPORT_JOB_MAX_FAILED_DETAILS],
+            "cancel_requested": False,
+            "error": None,
+            "submitted_at": datetime.utcnow().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        await run_blocking(shared_state.set_job, job["job_id"], job)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.tasks[job["job_id"]] = asyncio.create_task(self._run(job, groups))
+        self.jobs_submitted += 1
+        return job
+
+    async def cancel(self, job_id: str):
+        """Flag a job for cancellation; the worker running it stops before its next batch"""
+        await run_blocking(shared_state.request_job_cancel, job_id)
+
+    async def _save(self, job: dict):
+        await run_blocking(shared_state.set_job, job["job_id"], job)
+        await self.manager.notify({"type": "import_progress", "data": progress_view(job)})
+
+    async def _cancel_requested(self, job: dict) -> bool:
+        if await run_blocking(shared_state.is_job_cancel_requested, job["job_id"]):
+            job["cancel_requested"] = True
+        return job["cancel_requested"]
+
+    async def _run(self, job: dict, groups):
+        try:
+            async with self._semaphore:
+                job["status"] = JOB_RUNNING
+                job["started_at"] = datetime.utcnow().isoformat()
+                await self._save(job)
+                print(f"🚀 Import job {job['job_id']} started: {job['total_rows']} daily rows")
+
+                for group_key, day_rows in _batches(groups, self.batch_rows):
+                    if await self._cancel_requested(job):
+                        job["status"] = JOB_CANCELLED
+                        break
+
+                    try:
+                        result = await run_db_blocking(upsert_groups, {group_key: day_rows})
+                    except Exception as e:
+                        # The batch rolled back; report its rows and carry on with the rest
+                        job["failed"] += len(day_rows)
+                        room = IMPORT_JOB_MAX_FAILED_DETAILS - len(job["failed_details"])
+                        for template_index, day, _, truck_data in day_rows[:max(room, 0)]:
+                            job["failed_details"].append({
+                                "template": template_index + 1,
+                                "day": day,
+                                "shipping_no": truck_data['shipping_no'],
+                                "error": str(e)
+                            })
+                    else:
+                        job["created"] += result["created"]
+                        job["updated"] += result["updated"]
+                        response_cache.invalidate()
+                        try:
+                            async with self.manager.batch(source="import"):
+                                for change_type, row in result["changes"]:
+                                    await self.manager.broadcast({"type": change_type, "data": {"id": row["id"]}})
+                        except Exception as ws_error:
+                            print(f"WebSocket broadcast error: {ws_error}")
+
+                    job["rows_done"] += len(day_rows)
+                    await self._save(job)
+
+                if job["status"] == JOB_RUNNING:
+                    job["status"] = JOB_COMPLETED
+
+        except asyncio.CancelledError:
+            job["status"] = JOB_FAILED
+            job["error"] = "Worker shut down before the import finished"
+            raise
+        except Exception as e:
+            print(f"❌ Import job {job['job_id']} failed: {e}")
+            job["status"] = JOB_FAILED
+            job["error"] = str(e)
+        finally:
+            job["finished_at"] = datetime.utcnow().isoformat()
+            self.jobs_finished[job["status"]] = self.jobs_finished.get(job["status"], 0) + 1
+            self.tasks.pop(job["job_id"], None)
+            try:
+                await asyncio.shield(self._save(job))
+            except BaseException as e:
+                print(f"❌ Could not save import job {job['job_id']}: {e}")
+            print(f"✅ Import job {job['job_id']} {job['status']}: "
+                  f"{job['created']} created, {job['updated']} updated, {job['failed']} failed")
+
+    async def shutdown(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        if self.tasks:
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "active": len(self.tasks),
+            "submitted": self.jobs_submitted,
+            "finished": dict(self.jobs_finished),
+        }
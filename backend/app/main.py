@@ -1,24 +1,38 @@
-import pandas as pd
-from fastapi import UploadFile, File, Response, FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi import UploadFile, File, Query, Request, Response, FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, func  # Add func import here
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import and_, or_, func, select  # Add func import here
 from typing import List, Optional
 from jose import JWTError, jwt
-import bcrypt
 import os
 from dotenv import load_dotenv
 import json
 import uuid
-import io
-import xlsxwriter
+import asyncio
+import base64
 import math
-from datetime import datetime, timedelta, date
-from calendar import monthrange
-from .models import Truck, User, create_tables, get_db
+import zlib
+from email.utils import format_datetime, parsedate_to_datetime
+from datetime import datetime, timedelta, date, timezone
+from .models import Truck, User, create_tables, get_db, run_db, run_db_blocking, dispose_async_engine, database_settings_report, DB_ASYNC
 from .schemas import TruckCreate, TruckUpdate, Token, UserResponse, Truck as TruckSchema
+from .bulk_import import bulk_upsert_templates
+from . import stats_rollup
+from .response_cache import response_cache
+from .duplicate_index import duplicate_index, natural_key
+from .change_feed import changes_since, next_version, record_delete, prune_tombstones, dataset_version, CHANGE_FEED_DEFAULT_LIMIT, CHANGE_FEED_MAX_LIMIT
+from .shared_state import shared_state, run_session_sweeper, SessionTooLarge
+from .auth_cache import auth_cache
+from .passwords import hash_password, hash_password_async, verify_and_rehash_async, login_limiter
+from .ws_manager import ConnectionManager
+from .import_jobs import ImportJobRunner, progress_view, FINISHED_STATUSES
+from .export import stream_csv, stream_xlsx
+from .serialization import FastJSONResponse, TRUCK_FIELDS, truck_select, truck_rows, encode_truck_rows, truck_to_dict
+from .excel_import import read_import_file, spool_upload, import_template, IMPORT_TEMPLATE_MAX_AGE
+from .executor import run_blocking, run_cpu_bound, configure_threadpool, executor_stats, loop_lag, shutdown_pools
 
 
 
@@ -49,6 +63,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "Content-Disposition", "ETag", "Last-Modified"],
 )
 def get_cors_origins():
     """Get CORS origins based on environment"""
@@ -87,6 +102,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "Content-Disposition", "ETag", "Last-Modified"],
 )
 
 # Configuration
@@ -102,50 +118,122 @@ JWT_EXPIRATION_MINUTES = int(os.getenv("JWT_EXPIRATION_MINUTES", "60"))
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
 # WebSocket Manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-    
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+manager = ConnectionManager()
+
+# Background imports (progress is pushed through the WebSocket manager)
+import_jobs = ImportJobRunner(manager)
+
+# Events published by other workers
+async def handle_shared_event(channel: str, message: dict):
+    if channel in ("broadcast", "invalidate"):
+        response_cache.invalidate()
+        duplicate_index.invalidate()
+        dataset_version.invalidate()
+    # Job progress ("notify") is only relayed; nothing was written
+    if channel in ("broadcast", "notify"):
+        manager.send_local(message)
+    if channel == "users":
+        auth_cache.invalidate_users()
+    if channel == "resync":
+        # The listener reconnected and may have missed any of the events above
+        response_cache.invalidate()
+        duplicate_index.invalidate()
+        dataset_version.invalidate()
+        auth_cache.invalidate_users()
+        manager.send_local({"type": "resync"})
+
+@app.on_event("startup")
+async def start_shared_state_listener():
+    app.state.shared_state_listener = asyncio.create_task(shared_state.listen(handle_shared_event))
+    print(f"🔗 Shared state backend: {shared_state.name}")
+
+@app.on_event("startup")
+async def start_session_sweeper():
+    app.state.session_sweeper = asyncio.create_task(run_session_sweeper(shared_state))
+
+@app.on_event("startup")
+async def start_executors():
+    configure_threadpool()
+    loop_lag.start()
+    print(f"🗄️ Database layer: {'async (AsyncSession)' if DB_ASYNC else 'sync (thread pool)'}")
+    try:
+        removed = await run_db_blocking(prune_tombstones)
+        if removed:
+            print(f"🧹 Pruned {removed} change feed tombstones")
+    except Exception as e:
+        print(f"❌ Could not prune tombstones: {e}")
+    try:
+        await run_blocking(import_template)
+    except Exception as e:
+        print(f"❌ Could not build import template: {e}")
+    try:
+        for name, value in database_settings_report().items():
+            print(f"   {name}: {value}")
+    except Exception as e:
+        print(f"❌ Could not read database settings: {e}")
+
+@app.on_event("shutdown")
+async def stop_shared_state_listener():
+    listener = getattr(app.state, "shared_state_listener", None)
+    if listener:
+        listener.cancel()
+    sweeper = getattr(app.state, "session_sweeper", None)
+    if sweeper:
+        sweeper.cancel()
+
+@app.on_event("shutdown")
+async def stop_executors():
+    loop_lag.stop()
+    await import_jobs.shutdown()
+    shutdown_pools()
+    await dispose_async_engine()
+
+def is_not_modified(request: Request, etag: str, modified_at: Optional[datetime]) -> bool:
+    """Evaluate If-None-Match (weak comparison), or If-Modified-Since when it is absent"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag.removeprefix("W/") in tags
     
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and modified_at:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return modified_at.replace(microsecond=0, tzinfo=timezone.utc) <= since
+    return False
+
+async def dataset_validators(request: Request, endpoint: str):
+    """
+    ETag/Last-Modified for a read derived from the whole truck dataset.
+    Comes from the in-process dataset version, so a 304 costs no query.
+    Returns (headers, not_modified, version); cache the body under `version`
+    so it is never served with another version's ETag.
+    """
+    version, modified_at = await dataset_version.current(run_db)
+    query = "&".join(sorted(f"{name}={value}" for name, value in request.query_params.multi_items()))
+    etag = f'W/"{endpoint}-{version}-{zlib.crc32(query.encode()):08x}"'
     
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(json.dumps(message))
-            except:
-                pass
-
-manager = ConnectionManager()
-import_sessions = {}
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if modified_at:
+        headers["Last-Modified"] = format_datetime(modified_at.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers, is_not_modified(request, etag, modified_at), version
 
 # Helper function to clean data for JSON serialization
 def clean_for_json(data):
-    """Clean data to make it JSON compliant"""
+    """Clean data to make it JSON compliant (NaN/inf floats become None)"""
     if isinstance(data, dict):
         return {k: clean_for_json(v) for k, v in data.items()}
     elif isinstance(data, list):
         return [clean_for_json(item) for item in data]
-    elif isinstance(data, float):
-        if math.isnan(data) or math.isinf(data):
-            return None
-        return data
-    elif pd.isna(data):
+    elif isinstance(data, float) and not math.isfinite(data):
         return None
     else:
         return data
 
-def verify_password(plain_password, hashed_password):
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
-
-def get_password_hash(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -156,14 +244,17 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        # Tokens verified before skip the signature check until their exp
+        payload = auth_cache.get_claims(token)
+        if payload is None:
+            payload = auth_cache.set_claims(token, jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM]))
         username: str = payload.get("sub")
         role: str = payload.get("role", "viewer")
         is_guest: bool = payload.get("is_guest", False)
@@ -176,15 +267,30 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
             return UserResponse(id="guest", username="Guest Viewer", role="viewer")
         
         # Handle regular user
+        cached_user = auth_cache.get_user(username)
+        if cached_user:
+            return cached_user
+        
+        version = auth_cache.user_version
         user = db.query(User).filter(User.username == username).first()
         if not user:
             raise credentials_exception
         
-        return UserResponse(id=user.id, username=user.username, role=user.role)
+        current_user = UserResponse(id=user.id, username=user.username, role=user.role)
+        auth_cache.set_user(username, current_user, version)
+        return current_user
         
     except JWTError:
         raise credentials_exception
 
+def invalidate_user_cache():
+    """Drop cached users here and in every other worker"""
+    auth_cache.invalidate_users()
+    try:
+        shared_state.publish("users", {"reason": "users_changed"})
+    except Exception as e:
+        print(f"❌ Could not publish user change: {e}")
+
 def check_permission(required_role: str):
     def permission_checker(current_user: UserResponse = Depends(get_current_user)):
         role_hierarchy = {"viewer": 0, "user": 1, "admin": 2}
@@ -205,7 +311,7 @@ def init_default_user():
         if not existing_user:
             admin_user = User(
                 username="admin",
-                password_hash=get_password_hash("admin123"),
+                password_hash=hash_password("admin123"),
                 role="admin"
             )
             db.add(admin_user)
@@ -216,9 +322,20 @@ def init_default_user():
     finally:
         db.close()
 
+# Build the stats rollup for databases created before it existed
+def init_stats_rollup():
+    db = SessionLocal()
+    try:
+        stats_rollup.ensure_rollup(db)
+    except Exception as e:
+        print(f"❌ Error building stats rollup: {e}")
+    finally:
+        db.close()
+
 # Call init function
 from .models import SessionLocal
 init_default_user()
+init_stats_rollup()
 
 # Routes
 @app.get("/")
@@ -244,13 +361,22 @@ def read_root():
 
 
 @app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+def health_check(db: Session = Depends(get_db)):
     try:
         truck_count = db.query(Truck).count()
         return {
             "status": "healthy",
             "database": "connected",
             "truck_count": truck_count,
+            "response_cache": response_cache.stats(),
+            "websocket": manager.stats(),
+            "duplicate_index": duplicate_index.stats(),
+            "import_jobs": import_jobs.stats(),
+            "import_sessions": shared_state.session_stats(),
+            "auth_cache": auth_cache.stats(),
+            "login": login_limiter.stats(),
+            "dataset_version": dataset_version.stats(),
+            "executor": executor_stats(),
             "timestamp": datetime.utcnow().isoformat()
         }
     except Exception as e:
@@ -262,40 +388,44 @@ async def health_check(db: Session = Depends(get_db)):
         }
 
 @app.post("/api/auth/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    def load_user(db: Session):
+        return db.query(User).filter(User.username == form_data.username).first()
+    
+    def save_hash(db: Session, new_hash: str):
+        db.query(User).filter(User.id == user.id).update({User.password_hash: new_hash})
+        db.commit()
     
-    if not user or not verify_password(form_data.password, user.password_hash):
+    # A login storm for one account must not tie up the password pool
+    if not login_limiter.try_acquire(form_data.username):
         raise HTTPException(
-            status_code=401,
-            detail="Incorrect username or password",
-            headers={"WWW-Authenticate": "Bearer"},
+            status_code=429,
+            detail="Too many login attempts in progress for this user",
+            headers={"Retry-After": "1"},
         )
+    try:
+        user = await run_db(load_user)
+        valid, new_hash = (False, None)
+        if user:
+            valid, new_hash = await verify_and_rehash_async(form_data.password, user.password_hash)
+    finally:
+        login_limiter.release(form_data.username)
     
-    access_token_expires = timedelta(minutes=JWT_EXPIRATION_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username, "role": user.role},
-        expires_delta=access_token_expires
-    )
-    
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "role": user.role
-    }
-
-
-@app.post("/api/auth/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if not valid:
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # The hash was made with another BCRYPT_ROUNDS; store the upgraded one
+    if new_hash:
+        try:
+            await run_db(save_hash, new_hash)
+            login_limiter.rehashed += 1
+        except Exception as e:
+            print(f"❌ Could not rehash password for {user.username}: {e}")
+    
     access_token_expires = timedelta(minutes=JWT_EXPIRATION_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username, "role": user.role},
@@ -308,20 +438,38 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
         "role": user.role
     }
 
+
 # Add user registration endpoint
 @app.post("/api/auth/register")
 async def register_user(
     username: str,
     password: str,
     role: str = "user",
-    current_user: UserResponse = Depends(check_permission("admin")),
-    db: Session = Depends(get_db)
+    current_user: UserResponse = Depends(check_permission("admin"))
 ):
     """Register new user (admin only)"""
+    def user_exists(db: Session):
+        return db.query(User.id).filter(User.username == username).first() is not None
+    
+    def add_user(db: Session, password_hash: str):
+        new_user = User(
+            id=str(uuid.uuid4()),
+            username=username,
+            password_hash=password_hash,
+            role=role
+        )
+        db.add(new_user)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(status_code=400, detail="Username already exists")
+        db.refresh(new_user)
+        return new_user
+    
     try:
         # Check if user already exists
-        existing_user = db.query(User).filter(User.username == username).first()
-        if existing_user:
+        if await run_db(user_exists):
             raise HTTPException(status_code=400, detail="Username already exists")
         
         # Validate role
@@ -329,17 +477,9 @@ async def register_user(
         if role not in valid_roles:
             raise HTTPException(status_code=400, detail="Invalid role")
         
-        # Create new user
-        new_user = User(
-            id=str(uuid.uuid4()),
-            username=username,
-            password_hash=get_password_hash(password),
-            role=role
-        )
-        
-        db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        # Create new user (hashed on the password pool)
+        new_user = await run_db(add_user, await hash_password_async(password))
+        await run_blocking(invalidate_user_cache)
         
         return {
             "success": True,
@@ -384,39 +524,9 @@ async def guest_login():
         raise HTTPException(status_code=500, detail=f"Guest login failed: {str(e)}")
 
 
-# Update get_current_user to handle guest tokens
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        username: str = payload.get("sub")
-        role: str = payload.get("role", "viewer")
-        is_guest: bool = payload.get("is_guest", False)
-        
-        if username is None:
-            raise credentials_exception
-            
-        # Handle guest user
-        if is_guest and username == "guest_viewer":
-            return UserResponse(id="guest", username="Guest Viewer", role="viewer")
-        
-        # Handle regular user
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            raise credentials_exception
-        
-        return UserResponse(id=user.id, username=user.username, role=user.role)
-        
-    except JWTError:
-        raise credentials_exception
-
 # Add users management endpoints
 @app.get("/api/users")
-async def get_users(
+def get_users(
     current_user: UserResponse = Depends(check_permission("admin")),
     db: Session = Depends(get_db)
 ):
@@ -433,7 +543,7 @@ async def get_users(
     ]
 
 @app.delete("/api/users/{user_id}")
-async def delete_user(
+def delete_user(
     user_id: str,
     current_user: UserResponse = Depends(check_permission("admin")),
     db: Session = Depends(get_db)
@@ -448,134 +558,63 @@ async def delete_user(
     
     db.delete(user)
     db.commit()
+    invalidate_user_cache()
     
     return {"message": f"User '{user.username}' deleted successfully"}
 
-@app.get("/api/trucks", response_model=List[TruckSchema])
-async def get_trucks(
-    skip: int = 0,
-    limit: int = 100,
-    terminal: Optional[str] = None,
-    status_preparation: Optional[str] = None,
-    status_loading: Optional[str] = None,
-    date_from: Optional[str] = None,
-    date_to: Optional[str] = None,
-    current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    query = db.query(Truck)
-    
-    if terminal:
-        query = query.filter(Truck.terminal == terminal)
-    if status_preparation:
-        query = query.filter(Truck.status_preparation == status_preparation)
-    if status_loading:
-        query = query.filter(Truck.status_loading == status_loading)
-    if date_from:
-        date_from_dt = f"{date_from} 00:00:00"
-        query = query.filter(Truck.created_at >= date_from_dt)
-    if date_to:
-        date_to_dt = f"{date_to} 23:59:59"
-        query = query.filter(Truck.created_at <= date_to_dt)
-    
-    trucks = query.order_by(Truck.created_at.desc()).offset(skip).limit(limit).all()
-    
-    # Clean trucks data for JSON response
-    trucks_data = []
-    for truck in trucks:
-        truck_dict = {
-            "id": truck.id,
-            "terminal": truck.terminal,
-            "shipping_no": truck.shipping_no,
-            "dock_code": truck.dock_code,
-            "truck_route": truck.truck_route,
-            "preparation_start": truck.preparation_start,
-            "preparation_end": truck.preparation_end,
-            "loading_start": truck.loading_start,
-            "loading_end": truck.loading_end,
-            "status_preparation": truck.status_preparation,
-            "status_loading": truck.status_loading,
-            "created_at": truck.created_at.isoformat(),
-            "updated_at": truck.updated_at.isoformat() if truck.updated_at else None
-        }
-        trucks_data.append(clean_for_json(truck_dict))
-    
-    return trucks_data
-
 @app.get("/api/stats")
 async def get_stats(
+    request: Request,
+    response: Response,
     terminal: Optional[str] = None,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
-    current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserResponse = Depends(get_current_user)
 ):
     print(f"📊 API Request - get_stats with params:")
     print(f"   terminal: {terminal}")
     print(f"   date_from: {date_from}")
     print(f"   date_to: {date_to}")
     
+    validators, not_modified, version = await dataset_validators(request, "stats")
+    if not_modified:
+        return Response(status_code=304, headers=validators)
+    response.headers.update(validators)
+    
+    cache_key = response_cache.make_key("stats", version=version, terminal=terminal, date_from=date_from, date_to=date_to)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    generation = response_cache.generation
+    
     try:
-        query = db.query(Truck)
-        
-        if terminal:
-            query = query.filter(Truck.terminal == terminal)
-            print(f"   Applied terminal filter: {terminal}")
+        from_date = None
+        to_date = None
         
         # Enhanced date filtering (same as get_trucks)
         if date_from:
             try:
-                from_date = datetime.strptime(date_from, '%Y-%m-%d')
-                from_datetime = from_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                query = query.filter(Truck.created_at >= from_datetime)
-                print(f"   Applied date_from filter: {from_datetime}")
+                from_date = datetime.strptime(date_from, '%Y-%m-%d').date()
+                print(f"   Applied date_from filter: {from_date}")
             except ValueError as e:
                 print(f"   ❌ Invalid date_from format: {date_from}, error: {e}")
                 raise HTTPException(status_code=400, detail=f"Invalid date_from format. Use YYYY-MM-DD. Got: {date_from}")
         
         if date_to:
             try:
-                to_date = datetime.strptime(date_to, '%Y-%m-%d')
-                to_datetime = to_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-                query = query.filter(Truck.created_at <= to_datetime)
-                print(f"   Applied date_to filter: {to_datetime}")
+                to_date = datetime.strptime(date_to, '%Y-%m-%d').date()
+                print(f"   Applied date_to filter: {to_date}")
             except ValueError as e:
                 print(f"   ❌ Invalid date_to format: {date_to}, error: {e}")
                 raise HTTPException(status_code=400, detail=f"Invalid date_to format. Use YYYY-MM-DD. Got: {date_to}")
         
-        trucks = query.all()
-        print(f"   Found {len(trucks)} total records for stats")
-        
-        # Calculate statistics
-        total_trucks = len(trucks)
-        preparation_stats = {"On Process": 0, "Delay": 0, "Finished": 0}
-        loading_stats = {"On Process": 0, "Delay": 0, "Finished": 0}
-        terminal_stats = {}
-        
-        for truck in trucks:
-            # Preparation stats
-            prep_status = truck.status_preparation or "On Process"
-            if prep_status in preparation_stats:
-                preparation_stats[prep_status] += 1
-            
-            # Loading stats
-            load_status = truck.status_loading or "On Process"
-            if load_status in loading_stats:
-                loading_stats[load_status] += 1
-            
-            # Terminal stats
-            term = truck.terminal or "Unknown"
-            terminal_stats[term] = terminal_stats.get(term, 0) + 1
-        
-        stats_result = {
-            "total_trucks": total_trucks,
-            "preparation_stats": preparation_stats,
-            "loading_stats": loading_stats,
-            "terminal_stats": terminal_stats
-        }
+        # Sum the (day, terminal) rollup rows instead of scanning trucks
+        stats_result = await run_db(stats_rollup.query_stats, terminal=terminal, from_date=from_date, to_date=to_date)
         
         print(f"   ✅ Stats calculated: {stats_result}")
-        return clean_for_json(stats_result)
+        stats_result = clean_for_json(stats_result)
+        response_cache.set(cache_key, stats_result, generation)
+        return stats_result
     
     except HTTPException:
         raise  # Re-raise HTTP exceptions
@@ -586,100 +625,150 @@ async def get_stats(
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+def parse_date_range(date_from: Optional[str], date_to: Optional[str]):
+    """Parse YYYY-MM-DD filters into inclusive start/end-of-day datetimes"""
+    from_datetime = None
+    to_datetime = None
+    
+    if date_from:
+        try:
+            # Parse date_from and set to start of day
+            from_date = datetime.strptime(date_from, '%Y-%m-%d')
+            from_datetime = from_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        except ValueError as e:
+            print(f"   ❌ Invalid date_from format: {date_from}, error: {e}")
+            raise HTTPException(status_code=400, detail=f"Invalid date_from format. Use YYYY-MM-DD. Got: {date_from}")
+    
+    if date_to:
+        try:
+            # Parse date_to and set to end of day
+            to_date = datetime.strptime(date_to, '%Y-%m-%d')
+            to_datetime = to_date.replace(hour=23, minute=59, second=59, microsecond=999999)
+        except ValueError as e:
+            print(f"   ❌ Invalid date_to format: {date_to}, error: {e}")
+            raise HTTPException(status_code=400, detail=f"Invalid date_to format. Use YYYY-MM-DD. Got: {date_to}")
+    
+    return from_datetime, to_datetime
+
+def apply_truck_filters(query, terminal=None, status_preparation=None, status_loading=None,
+                        from_datetime=None, to_datetime=None):
+    """Filters shared by /api/trucks and /api/trucks/export"""
+    if terminal:
+        query = query.filter(Truck.terminal == terminal)
+    if status_preparation:
+        query = query.filter(Truck.status_preparation == status_preparation)
+    if status_loading:
+        query = query.filter(Truck.status_loading == status_loading)
+    if from_datetime:
+        query = query.filter(Truck.created_at >= from_datetime)
+    if to_datetime:
+        query = query.filter(Truck.created_at <= to_datetime)
+    return query
+
+def encode_cursor(created_at: datetime, truck_id: str) -> str:
+    """Opaque keyset cursor for the (created_at, id) ordering"""
+    raw = json.dumps([created_at.isoformat(), truck_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, truck_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(created_at), str(truck_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/api/trucks", response_model=List[TruckSchema])
 async def get_trucks(
+    request: Request,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=0),
+    cursor: Optional[str] = None,
+    include_total: bool = False,
     terminal: Optional[str] = None,
     status_preparation: Optional[str] = None,
     status_loading: Optional[str] = None,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
-    current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserResponse = Depends(get_current_user)
 ):
+    """
+    List trucks newest first.
+    Pass the X-Next-Cursor response header back as `cursor` for constant-cost
+    keyset paging; `skip` is still honoured when no cursor is given.
+    """
     print(f"🔍 API Request - get_trucks with params:")
-    print(f"   skip: {skip}, limit: {limit}")
+    print(f"   skip: {skip}, limit: {limit}, cursor: {cursor}, include_total: {include_total}")
     print(f"   terminal: {terminal}")
     print(f"   status_preparation: {status_preparation}")
     print(f"   status_loading: {status_loading}")
     print(f"   date_from: {date_from}")
     print(f"   date_to: {date_to}")
     
+    # Read before the query, so the ETag is never newer than the data
+    validators, not_modified, version = await dataset_validators(request, "trucks")
+    if not_modified:
+        return Response(status_code=304, headers=validators)
+    
+    cache_key = response_cache.make_key(
+        "trucks", version=version, skip=skip, limit=limit, cursor=cursor, include_total=include_total,
+        terminal=terminal, status_preparation=status_preparation, status_loading=status_loading,
+        date_from=date_from, date_to=date_to
+    )
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        body, page_headers = cached
+        print(f"   ✅ Returning cached page ({len(body)} bytes)")
+        return Response(content=body, media_type="application/json", headers={**validators, **page_headers})
+    generation = response_cache.generation
+    
     try:
-        query = db.query(Truck)
-        
-        # Apply filters
-        if terminal:
-            query = query.filter(Truck.terminal == terminal)
-            print(f"   Applied terminal filter: {terminal}")
+        from_datetime, to_datetime = parse_date_range(date_from, date_to)
+        cursor_position = decode_cursor(cursor) if cursor else None
         
-        if status_preparation:
-            query = query.filter(Truck.status_preparation == status_preparation)
-            print(f"   Applied prep status filter: {status_preparation}")
+        def fetch_page(db: Session):
+            query = apply_truck_filters(
+                truck_select(), terminal, status_preparation, status_loading, from_datetime, to_datetime
+            )
             
-        if status_loading:
-            query = query.filter(Truck.status_loading == status_loading)
-            print(f"   Applied loading status filter: {status_loading}")
-        
-        # Enhanced date filtering
-        if date_from:
-            try:
-                # Parse date_from and set to start of day
-                from_date = datetime.strptime(date_from, '%Y-%m-%d')
-                from_datetime = from_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                query = query.filter(Truck.created_at >= from_datetime)
-                print(f"   Applied date_from filter: {from_datetime}")
-            except ValueError as e:
-                print(f"   ❌ Invalid date_from format: {date_from}, error: {e}")
-                raise HTTPException(status_code=400, detail=f"Invalid date_from format. Use YYYY-MM-DD. Got: {date_from}")
-        
-        if date_to:
-            try:
-                # Parse date_to and set to end of day
-                to_date = datetime.strptime(date_to, '%Y-%m-%d')
-                to_datetime = to_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-                query = query.filter(Truck.created_at <= to_datetime)
-                print(f"   Applied date_to filter: {to_datetime}")
-            except ValueError as e:
-                print(f"   ❌ Invalid date_to format: {date_to}, error: {e}")
-                raise HTTPException(status_code=400, detail=f"Invalid date_to format. Use YYYY-MM-DD. Got: {date_to}")
+            # Counting costs a second scan, so only do it on request
+            total = db.execute(select(func.count()).select_from(query.subquery())).scalar() if include_total else None
+            
+            # Apply ordering and pagination
+            query = query.order_by(Truck.created_at.desc(), Truck.id.desc())
+            if cursor_position:
+                cursor_created_at, cursor_id = cursor_position
+                query = query.filter(or_(
+                    Truck.created_at < cursor_created_at,
+                    and_(Truck.created_at == cursor_created_at, Truck.id < cursor_id)
+                ))
+            elif skip:
+                query = query.offset(skip)
+            
+            # Fetch one extra row to know whether another page exists
+            return total, db.execute(query.limit(limit + 1)).all()
         
-        # Get total count before pagination for debugging
-        total_count = query.count()
-        print(f"   Total records matching filters: {total_count}")
+        total, trucks = await run_db(fetch_page)
         
-        # Apply ordering and pagination
-        trucks = query.order_by(Truck.created_at.desc()).offset(skip).limit(limit).all()
+        page_headers = {}
+        if total is not None:
+            page_headers["X-Total-Count"] = str(total)
+        has_more = len(trucks) > limit
+        trucks = trucks[:limit]
+        if has_more and trucks:
+            page_headers["X-Next-Cursor"] = encode_cursor(trucks[-1].created_at, trucks[-1].id)
         print(f"   Retrieved {len(trucks)} records after pagination")
         
-        # Clean trucks data for JSON response
-        trucks_data = []
-        for truck in trucks:
-            truck_dict = {
-                "id": truck.id,
-                "terminal": truck.terminal,
-                "shipping_no": truck.shipping_no,
-                "dock_code": truck.dock_code,
-                "truck_route": truck.truck_route,
-                "preparation_start": truck.preparation_start,
-                "preparation_end": truck.preparation_end,
-                "loading_start": truck.loading_start,
-                "loading_end": truck.loading_end,
-                "status_preparation": truck.status_preparation,
-                "status_loading": truck.status_loading,
-                "created_at": truck.created_at.isoformat(),
-                "updated_at": truck.updated_at.isoformat() if truck.updated_at else None
-            }
-            trucks_data.append(clean_for_json(truck_dict))
+        # Column tuples straight to JSON bytes; cached as bytes too
+        body = encode_truck_rows(trucks)
         
-        print(f"   ✅ Returning {len(trucks_data)} cleaned records")
+        print(f"   ✅ Returning {len(trucks)} records ({len(body)} bytes)")
         
         # Log sample data for debugging
-        if trucks_data:
-            print(f"   Sample record: {trucks_data[0]}")
+        if trucks:
+            print(f"   Sample record: {truck_rows(trucks[:1])[0]}")
         
-        return trucks_data
+        response_cache.set(cache_key, (body, page_headers), generation)
+        return Response(content=body, media_type="application/json", headers={**validators, **page_headers})
     
     except HTTPException:
         raise  # Re-raise HTTP exceptions
@@ -689,134 +778,90 @@ async def get_trucks(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@app.get("/api/trucks/template")
-async def download_import_template():
-    """Download Excel template with flexible duplicate examples"""
+EXPORT_YIELD_PER = 1000
+
+def iter_export_rows(terminal, status_preparation, status_loading, from_datetime, to_datetime):
+    """Stream row tuples with a server-side cursor on a session owned by the response"""
+    db = SessionLocal()
+    try:
+        query = apply_truck_filters(
+            db.query(
+                Truck.id, Truck.terminal, Truck.shipping_no, Truck.dock_code, Truck.truck_route,
+                Truck.preparation_start, Truck.preparation_end, Truck.loading_start, Truck.loading_end,
+                Truck.status_preparation, Truck.status_loading, Truck.created_at, Truck.updated_at
+            ),
+            terminal, status_preparation, status_loading, from_datetime, to_datetime
+        )
+        for row in query.order_by(Truck.created_at.desc(), Truck.id.desc()).yield_per(EXPORT_YIELD_PER):
+            yield row
+    finally:
+        db.close()
+
+@app.get("/api/trucks/changes")
+async def get_truck_changes(
+    since: int = 0,
+    limit: int = CHANGE_FEED_DEFAULT_LIMIT,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """
+    Trucks created/updated and ids deleted after dataset version `since`.
+    Start from 0, then pass the returned `version` back as `since`; keep
+    paging while has_more is true. reset=true means the client is too far
+    behind for the kept tombstones and must reload /api/trucks.
+    """
+    if since < 0:
+        raise HTTPException(status_code=400, detail="since must be >= 0")
+    limit = max(1, min(limit, CHANGE_FEED_MAX_LIMIT))
     
-    # ✅ UPDATED: Template data showing duplicate examples
-    template_data = {
-        'Month': ['2024-01', '2024-01', '2024-02', '2024-02'],
-        'Terminal': ['A', 'A', 'B', 'B'], 
-        'Shipping No': ['SHP001', 'SHP002', 'SHP001', 'SHP001'],
-        'Dock Code': ['DOCK-A1', 'DOCK-A1', 'DOCK-B1', 'DOCK-B2'],  # Same dock allowed
-        'Route': ['Bangkok-Chonburi', 'Bangkok-Rayong', 'Bangkok-Chonburi', 'Bangkok-Chonburi'],  # Same route allowed
-        'Prep Start': ['08:00', '09:00', '08:00', '10:00'],
-        'Prep End': ['08:30', '09:30', '08:30', '10:15'],
-        'Load Start': ['09:00', '10:00', '09:00', '11:00'],
-        'Load End': ['10:00', '11:30', '10:00', '12:45'],
-        'Status Prep': ['Finished', 'Finished', 'On Process', 'Delay'],
-        'Status Load': ['Finished', 'On Process', 'On Process', 'On Process']
-    }
+    feed = await run_db(changes_since, since, limit)
+    feed["trucks"] = [dict(zip(TRUCK_FIELDS + ["version"], row)) for row in feed["trucks"]]
+    return FastJSONResponse(feed)
+
+@app.get("/api/trucks/export")
+def export_trucks(
+    format: str = "csv",
+    terminal: Optional[str] = None,
+    status_preparation: Optional[str] = None,
+    status_loading: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Export trucks matching the /api/trucks filters as streamed CSV or XLSX"""
+    if format not in ("csv", "xlsx"):
+        raise HTTPException(status_code=400, detail="Invalid format. Use csv or xlsx")
     
-    df = pd.DataFrame(template_data)
-    output = io.BytesIO()
+    from_datetime, to_datetime = parse_date_range(date_from, date_to)
+    rows = iter_export_rows(terminal, status_preparation, status_loading, from_datetime, to_datetime)
+    filename = f"trucks_export_{datetime.utcnow().strftime('%Y-%m-%d')}.{format}"
     
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, sheet_name='Template', index=False)
-        workbook = writer.book
-        worksheet = writer.sheets['Template']
-        
-        # Header formatting
-        header_format = workbook.add_format({
-            'bold': True,
-            'bg_color': '#2196F3',
-            'font_color': 'white',
-            'border': 1,
-            'align': 'center'
-        })
-        
-        # Time format - keep as text to prevent Excel auto-conversion
-        time_format = workbook.add_format({'num_format': '@'})
-        
-        # Apply header format
-        for col_num, value in enumerate(df.columns.values):
-            worksheet.write(0, col_num, value, header_format)
-        
-        # Format time columns as text (columns F, G, H, I = 5, 6, 7, 8)
-        worksheet.set_column('F:I', 12, time_format)  # Time columns
-        
-        # Set other column widths
-        worksheet.set_column('A:A', 12)  # Month
-        worksheet.set_column('B:B', 12)  # Terminal
-        worksheet.set_column('C:C', 15)  # Shipping No
-        worksheet.set_column('D:D', 12)  # Dock Code
-        worksheet.set_column('E:E', 20)  # Route
-        worksheet.set_column('J:K', 12)  # Status columns
-        
-        # ✅ UPDATED: Instructions sheet with flexible duplicate rules
-        instructions = workbook.add_worksheet('Instructions')
-        instructions.write('A1', 'Flexible Monthly Import Instructions:', workbook.add_format({'bold': True, 'size': 14}))
-        
-        instruction_list = [
-            '',  # Empty line
-            'BASIC RULES:',
-            '1. Fill in the Template sheet with your monthly truck data',
-            '2. Required fields: Month, Terminal, Shipping No, Dock Code, Route',
-            '3. Month format: YYYY-MM (e.g., 2024-01 for January 2024)',
-            '4. Time format: HH:MM (e.g., 08:00, 14:30)',
-            '5. Valid status values: "On Process", "Delay", "Finished"',
-            '',
-            'DUPLICATE HANDLING:',
-            '6. ✅ DUPLICATES ALLOWED: Same dock codes, terminals, routes can exist',
-            '7. ✅ FLEXIBLE UPDATES: Only exact matches get updated',
-            '8. ✅ SMART CREATION: Different combinations create new records',
-            '',
-            'UPDATE CONDITIONS (ALL must match):',
-            '9. Same Date + Same Terminal + Same Shipping No + Same Dock Code + Same Route',
-            '10. Example: 2024-01-15, Terminal A, SHP001, DOCK-01, Route ABC → Updates',
-            '11. Different: 2024-01-15, Terminal A, SHP001, DOCK-02, Route ABC → New record',
-            '',
-            'MONTHLY PROCESSING:',
-            '12. Each row creates daily records for the entire month',
-            '13. Example: "2024-01" creates 31 records (Jan 1-31, 2024)',
-            '14. Time fields are copied to all daily records',
-            '15. Save file and upload through Management page'
-        ]
-        
-        for i, instruction in enumerate(instruction_list):
-            cell_format = workbook.add_format({'bold': True}) if instruction.startswith(('BASIC', 'DUPLICATE', 'UPDATE', 'MONTHLY')) else None
-            instructions.write(f'A{i+3}', instruction, cell_format)
-        
-        # ✅ ADD: Examples sheet
-        examples = workbook.add_worksheet('Examples')
-        examples.write('A1', 'Import Behavior Examples:', workbook.add_format({'bold': True, 'size': 14}))
-        
-        example_scenarios = [
-            '',
-            'SCENARIO 1 - WILL UPDATE:',
-            'Existing: 2024-01-15 | Terminal A | SHP001 | DOCK-01 | Route ABC',
-            'Import:   2024-01-15 | Terminal A | SHP001 | DOCK-01 | Route ABC',
-            'Result:   Updates preparation/loading times and status only',
-            '',
-            'SCENARIO 2 - WILL CREATE NEW (Different Dock):',
-            'Existing: 2024-01-15 | Terminal A | SHP001 | DOCK-01 | Route ABC',
-            'Import:   2024-01-15 | Terminal A | SHP001 | DOCK-02 | Route ABC',
-            'Result:   Creates new record (dock code different)',
-            '',
-            'SCENARIO 3 - WILL CREATE NEW (Different Date):',
-            'Existing: 2024-01-15 | Terminal A | SHP001 | DOCK-01 | Route ABC',
-            'Import:   2024-01-16 | Terminal A | SHP001 | DOCK-01 | Route ABC',
-            'Result:   Creates new record (date different)',
-            '',
-            'SCENARIO 4 - DUPLICATES ALLOWED:',
-            'Multiple records can have:',
-            '- Same dock codes (DOCK-01, DOCK-01, DOCK-01)',
-            '- Same terminals (Terminal A for many records)',  
-            '- Same routes (Bangkok-Chonburi for many trucks)',
-            '- Same shipping numbers (on different dates)',
-            '',
-            'KEY POINT: Only EXACT matches (all 5 fields) get updated!'
-        ]
-        
-        for i, example in enumerate(example_scenarios):
-            cell_format = workbook.add_format({'bold': True}) if example.startswith(('SCENARIO', 'KEY POINT')) else None
-            examples.write(f'A{i+3}', example, cell_format)
+    if format == "xlsx":
+        content = stream_xlsx(rows)
+        media_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        content = stream_csv(rows)
+        media_type = 'text/csv; charset=utf-8'
+    
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Cache-Control': 'no-cache'
+        }
+    )
 
-    output.seek(0)
+@app.get("/api/trucks/template")
+def download_import_template(request: Request):
+    """Download Excel template with flexible duplicate examples (built once, at startup or on first use)"""
+    content, etag = import_template()
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={IMPORT_TEMPLATE_MAX_AGE}"}
+    if is_not_modified(request, etag, None):
+        return Response(status_code=304, headers=headers)
     return Response(
-        content=output.getvalue(),
+        content=content,
         media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        headers={'Content-Disposition': 'attachment; filename=truck_flexible_monthly_import_template.xlsx'}
+        headers={**headers, 'Content-Disposition': 'attachment; filename=truck_flexible_monthly_import_template.xlsx'}
     )
 
 # ============================================================================
@@ -837,7 +882,7 @@ def get_existing_truck_by_all_criteria(
     """
     return db.query(Truck).filter(
         and_(
-            func.date(Truck.created_at) == record_date,
+            Truck.record_date == record_date,
             Truck.terminal == terminal,
             Truck.shipping_no == shipping_no,
             Truck.dock_code == dock_code,
@@ -849,26 +894,11 @@ def count_duplicate_combinations(db: Session):
     """
     Debug function to show duplicate statistics
     """
-    # Count records with same dock codes
-    dock_duplicates = db.query(
-        Truck.dock_code, 
-        func.count(Truck.id).label('count')
-    ).group_by(Truck.dock_code).having(func.count(Truck.id) > 1).all()
-    
-    # Count records with same shipping numbers
-    shipping_duplicates = db.query(
-        Truck.shipping_no, 
-        func.count(Truck.id).label('count')
-    ).group_by(Truck.shipping_no).having(func.count(Truck.id) > 1).all()
-    
-    return {
-        "dock_code_duplicates": [{"dock_code": d.dock_code, "count": d.count} for d in dock_duplicates],
-        "shipping_no_duplicates": [{"shipping_no": s.shipping_no, "count": s.count} for s in shipping_duplicates],
-        "total_records": db.query(Truck).count()
-    }
+    # Served from the in-memory counters; the DB is only read on first use
+    return duplicate_index.duplicate_stats(db)
 
 @app.get("/api/trucks/duplicate-stats")
-async def get_duplicate_statistics(
+def get_duplicate_statistics(
     current_user: UserResponse = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -889,171 +919,31 @@ async def preview_excel_import(
     file: UploadFile = File(...),
     current_user: UserResponse = Depends(check_permission("user"))
 ):
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(400, "File must be Excel format (.xlsx or .xls)")
+    if not file.filename.lower().endswith(('.xlsx', '.xls', '.csv')):
+        raise HTTPException(400, "File must be Excel format (.xlsx or .xls) or CSV")
     
+    spooled_path = None
     try:
-        contents = await file.read()
-        df = pd.read_excel(io.BytesIO(contents))
-        
-        required_columns = {
-            'Month': 'month',
-            'Terminal': 'terminal',
-            'Shipping No': 'shipping_no',
-            'Dock Code': 'dock_code',
-            'Route': 'truck_route'
-        }
+        # Spool to disk and parse in row chunks in the Excel process pool
+        spooled_path = await run_blocking(spool_upload, file.file, file.filename)
+        workbook = await run_cpu_bound(read_import_file, spooled_path)
         
-        missing_cols = [col for col in required_columns.keys() if col not in df.columns]
+        missing_cols = workbook['missing_columns']
         if missing_cols:
             raise HTTPException(400, f"Missing required columns: {', '.join(missing_cols)}")
         
-        optional_columns = {
-            'Prep Start': 'preparation_start',
-            'Prep End': 'preparation_end',
-            'Load Start': 'loading_start',
-            'Load End': 'loading_end',
-            'Status Prep': 'status_preparation',
-            'Status Load': 'status_loading'
-        }
-        
-        trucks_preview = []
-        errors = []
-        total_records_to_create = 0
-        
-        def format_time_field(value):
-            """Convert Excel time values to HH:MM format"""
-            if pd.isna(value) or value == '' or value is None:
-                return None
-            
-            try:
-                # If it's already a string
-                if isinstance(value, str):
-                    value = value.strip()
-                    if not value:
-                        return None
-                    # Check HH:MM format
-                    if ':' in value:
-                        parts = value.split(':')
-                        if len(parts) >= 2:
-                            hours = int(parts[0])
-                            minutes = int(parts[1])
-                            return f"{hours:02d}:{minutes:02d}"
-                    return value
-                
-                # If it's a number (Excel time format: 0.5 = 12:00)
-                if isinstance(value, (int, float)):
-                    # Excel stores time as decimal fraction of a day
-                    total_minutes = int(value * 24 * 60)
-                    hours = total_minutes // 60
-                    minutes = total_minutes % 60
-                    return f"{hours:02d}:{minutes:02d}"
-                
-                # If it's a datetime object
-                if hasattr(value, 'hour') and hasattr(value, 'minute'):
-                    return f"{value.hour:02d}:{value.minute:02d}"
-                
-                # Try to convert to string and process
-                str_value = str(value).strip()
-                if ':' in str_value:
-                    parts = str_value.split(':')
-                    if len(parts) >= 2:
-                        hours = int(float(parts[0]))
-                        minutes = int(float(parts[1]))
-                        return f"{hours:02d}:{minutes:02d}"
-                
-                print(f"⚠️ Could not format time value: {value} (type: {type(value)})")
-                return None
-                
-            except Exception as e:
-                print(f"❌ Time formatting error: {e}, Value: {value}")
-                return None
-        
-        # ✅ UPDATED: Remove duplicate validation, allow all records
-        for index, row in df.iterrows():
-            try:
-                truck_template = {}
-                
-                # Validate and parse month
-                month_str = row.get('Month', '')
-                if pd.isna(month_str) or str(month_str).strip() == '':
-                    errors.append(f"Row {index + 2}: Month is required")
-                    continue
-                
-                try:
-                    year, month = str(month_str).strip().split('-')
-                    year = int(year)
-                    month = int(month)
-                    if month < 1 or month > 12:
-                        raise ValueError("Invalid month")
-                    truck_template['year'] = year
-                    truck_template['month'] = month
-                    
-                    # Calculate days in month
-                    days_in_month = monthrange(year, month)[1]
-                    total_records_to_create += days_in_month
-                    
-                except (ValueError, IndexError):
-                    errors.append(f"Row {index + 2}: Month must be in format YYYY-MM (e.g., 2024-01)")
-                    continue
-                
-                # Process required columns
-                for excel_col, db_col in required_columns.items():
-                    if excel_col == 'Month':
-                        continue  # Already processed
-                    value = row.get(excel_col, '')
-                    if pd.isna(value) or str(value).strip() == '':
-                        errors.append(f"Row {index + 2}: {excel_col} is required")
-                        continue
-                    truck_template[db_col] = str(value).strip()
-                
-                # Process optional columns - pay attention to time fields
-                for excel_col, db_col in optional_columns.items():
-                    if excel_col in df.columns:
-                        value = row.get(excel_col)
-                        
-                        # Handle time fields specially
-                        if db_col in ['preparation_start', 'preparation_end', 'loading_start', 'loading_end']:
-                            formatted_time = format_time_field(value)
-                            truck_template[db_col] = formatted_time
-                            print(f"🕒 {db_col}: {value} -> {formatted_time}")
-                        else:
-                            # Handle status fields
-                            if not pd.isna(value) and str(value).strip():
-                                truck_template[db_col] = str(value).strip()
-                            else:
-                                truck_template[db_col] = None
-                    else:
-                        truck_template[db_col] = None
-                
-                # Set default statuses
-                if 'status_preparation' not in truck_template or not truck_template['status_preparation']:
-                    truck_template['status_preparation'] = 'On Process'
-                if 'status_loading' not in truck_template or not truck_template['status_loading']:
-                    truck_template['status_loading'] = 'On Process'
-                
-                # Validate statuses
-                valid_statuses = ['On Process', 'Delay', 'Finished']
-                if truck_template.get('status_preparation') not in valid_statuses:
-                    truck_template['status_preparation'] = 'On Process'
-                if truck_template.get('status_loading') not in valid_statuses:
-                    truck_template['status_loading'] = 'On Process'
-                
-                # Add sample preview
-                preview_truck = truck_template.copy()
-                preview_truck['preview_days'] = days_in_month
-                trucks_preview.append(preview_truck)
-                
-            except Exception as e:
-                errors.append(f"Row {index + 2}: {str(e)}")
+        # ✅ UPDATED: Column-wise parsing; duplicates allowed, rows validated as before
+        trucks_preview = workbook['truck_templates']
+        errors = workbook['errors']
+        total_records_to_create = workbook['total_records_to_create']
         
         session_id = str(uuid.uuid4())
-        import_sessions[session_id] = {
+        await run_blocking(lambda: shared_state.set_session(session_id, clean_for_json({
             'truck_templates': trucks_preview,
             'user_id': current_user.id,
-            'timestamp': datetime.utcnow(),
+            'timestamp': datetime.utcnow().isoformat(),
             'total_records_to_create': total_records_to_create
-        }
+        })))
         
         return clean_for_json({
             "success": True,
@@ -1062,22 +952,26 @@ async def preview_excel_import(
             "total_templates": len(trucks_preview),
             "total_records_to_create": total_records_to_create,
             "errors": errors,
-            "columns_found": list(df.columns),
+            "columns_found": workbook['columns'],
             "message": f"Will create {total_records_to_create} daily records from {len(trucks_preview)} monthly templates. Duplicate dock codes and other data are allowed. Only exact matches (date + terminal + shipping_no + dock_code + route) will be updated."
         })
         
+    except SessionTooLarge as e:
+        raise HTTPException(413, str(e))
     except Exception as e:
         raise HTTPException(400, f"Error reading Excel file: {str(e)}")
+    finally:
+        if spooled_path:
+            os.remove(spooled_path)
     
 
 @app.post("/api/trucks/import/confirm")
 async def confirm_excel_import(
     data: dict,
-    current_user: UserResponse = Depends(check_permission("user")),
-    db: Session = Depends(get_db)
+    current_user: UserResponse = Depends(check_permission("user"))
 ):
     session_id = data.get('session_id')
-    session = import_sessions.get(session_id)
+    session = await run_blocking(shared_state.get_session, session_id) if session_id else None
     if not session:
         raise HTTPException(400, "Import session not found or expired")
 
@@ -1085,126 +979,27 @@ async def confirm_excel_import(
         raise HTTPException(403, "Unauthorized")
 
     truck_templates = session['truck_templates']
-    imported_count = 0
-    updated_count = 0
-    created_count = 0
-    failed_imports = []
 
     print(f"🚀 Starting flexible import of {len(truck_templates)} templates")
 
     try:
-        for template_index, truck_template in enumerate(truck_templates):
-            try:
-                year = truck_template['year']
-                month = truck_template['month']
-                days_in_month = monthrange(year, month)[1]
-                base_shipping_no = truck_template['shipping_no']
-
-                print(f"📅 Processing template {template_index + 1}: {base_shipping_no} for {year}-{month} ({days_in_month} days)")
-
-                # Create a record for each day of the month
-                for day in range(1, days_in_month + 1):
-                    try:
-                        record_date = date(year, month, day)
-
-                        # ✅ UPDATED: Check for existing record with ALL matching criteria
-                        # Condition: date + terminal + shipping_no + dock_code + truck_route must all match
-                        existing = db.query(Truck).filter(
-                            and_(
-                                func.date(Truck.created_at) == record_date,
-                                Truck.terminal == truck_template['terminal'],
-                                Truck.shipping_no == base_shipping_no,
-                                Truck.dock_code == truck_template['dock_code'],
-                                Truck.truck_route == truck_template['truck_route']
-                            )
-                        ).first()
-
-                        # Prepare truck data dictionary
-                        truck_data_dict = {
-                            'terminal': truck_template['terminal'],
-                            'shipping_no': base_shipping_no,
-                            'dock_code': truck_template['dock_code'],
-                            'truck_route': truck_template['truck_route'],
-                            'preparation_start': truck_template.get('preparation_start'),
-                            'preparation_end': truck_template.get('preparation_end'),
-                            'loading_start': truck_template.get('loading_start'),
-                            'loading_end': truck_template.get('loading_end'),
-                            'status_preparation': truck_template.get('status_preparation', 'On Process'),
-                            'status_loading': truck_template.get('status_loading', 'On Process'),
-                        }
-                        
-                        print(f"📝 Processing truck data for {record_date}: {truck_data_dict['shipping_no']}")
-
-                        if existing:
-                            # ✅ UPDATE: Update existing record - only time fields and status
-                            print(f"🔄 Updating existing record: {existing.id}")
-                            for key, value in truck_data_dict.items():
-                                # Only update time and status fields, keep original core data
-                                if key in ['preparation_start', 'preparation_end', 'loading_start', 'loading_end', 'status_preparation', 'status_loading']:
-                                    setattr(existing, key, value)
-                            existing.updated_at = datetime.utcnow()
-                            created_truck = existing
-                            updated_count += 1
-                            
-                        else:
-                            # ✅ INSERT: Create new record (duplicates allowed)
-                            print(f"➕ Creating new record for {record_date}")
-                            db_truck = Truck(**truck_data_dict)
-                            db_truck.id = str(uuid.uuid4())
-                            db_truck.created_at = datetime.combine(record_date, datetime.min.time())
-                            db.add(db_truck)
-                            created_truck = db_truck
-                            created_count += 1
-
-                        db.commit()
-                        db.refresh(created_truck)
-                        imported_count += 1
-
-                        # Broadcast update (optional - for WebSocket)
-                        if hasattr(manager, 'broadcast'):  # Check if WebSocket manager exists
-                            try:
-                                await manager.broadcast({
-                                    "type": "truck_updated" if existing else "truck_created",
-                                    "data": {
-                                        "id": created_truck.id,
-                                        "terminal": created_truck.terminal,
-                                        "shipping_no": created_truck.shipping_no,
-                                        "dock_code": created_truck.dock_code,
-                                        "truck_route": created_truck.truck_route,
-                                        "preparation_start": created_truck.preparation_start,
-                                        "preparation_end": created_truck.preparation_end,
-                                        "loading_start": created_truck.loading_start,
-                                        "loading_end": created_truck.loading_end,
-                                        "status_preparation": created_truck.status_preparation,
-                                        "status_loading": created_truck.status_loading,
-                                        "created_at": created_truck.created_at.isoformat(),
-                                        "updated_at": created_truck.updated_at.isoformat() if created_truck.updated_at else None
-                                    }
-                                })
-                            except Exception as ws_error:
-                                print(f"WebSocket broadcast error: {ws_error}")
-
-                    except Exception as day_error:
-                        print(f"❌ Day error for template {template_index + 1}, day {day}: {str(day_error)}")
-                        failed_imports.append({
-                            "template": template_index + 1,
-                            "day": day,
-                            "shipping_no": base_shipping_no,
-                            "error": str(day_error)
-                        })
-                        db.rollback()  # Rollback failed transaction
-
-            except Exception as template_error:
-                print(f"❌ Template error for template {template_index + 1}: {str(template_error)}")
-                failed_imports.append({
-                    "template": template_index + 1,
-                    "shipping_no": truck_template.get('shipping_no', 'Unknown'),
-                    "error": str(template_error)
-                })
+        result = await run_db_blocking(bulk_upsert_templates, truck_templates)
+        failed_imports = result['failed_details']
+        created_count = result['created']
+        updated_count = result['updated']
+        imported_count = created_count + updated_count
+        response_cache.invalidate()
+
+        # One trucks_bulk_changed message for the whole import
+        try:
+            async with manager.batch(source="import"):
+                for change_type, row in result['changes']:
+                    await manager.broadcast({"type": change_type, "data": {"id": row['id']}})
+        except Exception as ws_error:
+            print(f"WebSocket broadcast error: {ws_error}")
 
         # Clean up session
-        if session_id in import_sessions:
-            del import_sessions[session_id]
+        await run_blocking(shared_state.delete_session, session_id)
 
         print(f"✅ Import completed: {imported_count} imported ({updated_count} updated, {created_count} created), {len(failed_imports)} failed")
 
@@ -1223,15 +1018,70 @@ async def confirm_excel_import(
         import traceback
         traceback.print_exc()
 
-        # Clean up session on error
-        if session_id in import_sessions:
-            del import_sessions[session_id]
-
+        # The session is kept so the import can be confirmed again; rows match on their natural key
         raise HTTPException(500, f"Import failed: {str(e)}")
     
 
+@app.post("/api/trucks/import/jobs", status_code=202)
+async def submit_import_job(
+    data: dict,
+    current_user: UserResponse = Depends(check_permission("user"))
+):
+    """Start a confirmed import in the background; progress arrives on /ws as import_progress"""
+    session_id = data.get('session_id')
+    session = await run_blocking(shared_state.get_session, session_id) if session_id else None
+    if not session:
+        raise HTTPException(400, "Import session not found or expired")
+
+    if session['user_id'] != current_user.id:
+        raise HTTPException(403, "Unauthorized")
+
+    # The job owns the templates from here; a second submit of the session is refused
+    await run_blocking(shared_state.delete_session, session_id)
+    job = await import_jobs.submit(session['truck_templates'], user_id=current_user.id, session_id=session_id)
+
+    return {
+        "success": True,
+        **progress_view(job),
+        "message": f"Import job queued for {job['total_rows']} daily records"
+    }
+
+async def get_owned_job(job_id: str, current_user: UserResponse):
+    job = await run_blocking(shared_state.get_job, job_id)
+    if not job:
+        raise HTTPException(404, "Import job not found")
+    if job['user_id'] != current_user.id and current_user.role != "admin":
+        raise HTTPException(403, "Unauthorized")
+    return job
+
+@app.get("/api/trucks/import/jobs/{job_id}")
+async def get_import_job(
+    job_id: str,
+    current_user: UserResponse = Depends(check_permission("user"))
+):
+    """Current state of an import job, including failed_details"""
+    job = await get_owned_job(job_id, current_user)
+    return clean_for_json(job)
+
+@app.post("/api/trucks/import/jobs/{job_id}/cancel")
+async def cancel_import_job(
+    job_id: str,
+    current_user: UserResponse = Depends(check_permission("user"))
+):
+    """Stop a queued or running import before its next batch; committed batches stay"""
+    job = await get_owned_job(job_id, current_user)
+    if job['status'] in FINISHED_STATUSES:
+        raise HTTPException(409, f"Import job already {job['status']}")
+
+    await import_jobs.cancel(job_id)
+    return {
+        "success": True,
+        "job_id": job_id,
+        "message": "Cancellation requested"
+    }
+
 @app.get("/api/trucks/check-duplicates")
-async def check_duplicate_conditions(
+def check_duplicate_conditions(
     date: str,
     terminal: str,
     shipping_no: str,
@@ -1248,16 +1098,10 @@ async def check_duplicate_conditions(
         except ValueError:
             raise HTTPException(400, f"Invalid date format. Use YYYY-MM-DD. Got: {date}")
         
-        # Check for existing record with ALL matching criteria
-        existing = db.query(Truck).filter(
-            and_(
-                func.date(Truck.created_at) == record_date,
-                Truck.terminal == terminal,
-                Truck.shipping_no == shipping_no,
-                Truck.dock_code == dock_code,
-                Truck.truck_route == truck_route
-            )
-        ).first()
+        # Check for existing record with ALL matching criteria (in-memory key set first)
+        existing = None
+        if duplicate_index.contains(db, (record_date, terminal, shipping_no, dock_code, truck_route)):
+            existing = get_existing_truck_by_all_criteria(db, record_date, terminal, shipping_no, dock_code, truck_route)
 
         return {
             "exists": bool(existing),
@@ -1286,83 +1130,73 @@ async def check_duplicate_conditions(
 @app.get("/api/trucks/{truck_id}")
 async def get_truck(
     truck_id: str,
-    current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserResponse = Depends(get_current_user)
 ):
-    truck = db.query(Truck).filter(Truck.id == truck_id).first()
-    if not truck:
+    row = await run_db(lambda db: db.execute(truck_select().where(Truck.id == truck_id)).first())
+    if not row:
         raise HTTPException(status_code=404, detail="Truck not found")
     
-    truck_data = {
-        "id": truck.id,
-        "terminal": truck.terminal,
-        "shipping_no": truck.shipping_no,
-        "dock_code": truck.dock_code,
-        "truck_route": truck.truck_route,
-        "preparation_start": truck.preparation_start,
-        "preparation_end": truck.preparation_end,
-        "loading_start": truck.loading_start,
-        "loading_end": truck.loading_end,
-        "status_preparation": truck.status_preparation,
-        "status_loading": truck.status_loading,
-        "created_at": truck.created_at.isoformat(),
-        "updated_at": truck.updated_at.isoformat() if truck.updated_at else None
-    }
-    
-    return clean_for_json(truck_data)
+    return FastJSONResponse(truck_rows([row])[0])
 
 @app.put("/api/trucks/{truck_id}", response_model=TruckSchema)
 async def update_truck(
     truck_id: str,
     truck: TruckUpdate,
-    current_user: UserResponse = Depends(check_permission("user")),
-    db: Session = Depends(get_db)
+    current_user: UserResponse = Depends(check_permission("user"))
 ):
-    db_truck = db.query(Truck).filter(Truck.id == truck_id).first()
-    if not db_truck:
-        raise HTTPException(status_code=404, detail="Truck not found")
-    
-    update_data = truck.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_truck, key, value)
+    def apply_update(db: Session):
+        db_truck = db.query(Truck).filter(Truck.id == truck_id).first()
+        if not db_truck:
+            raise HTTPException(status_code=404, detail="Truck not found")
+        
+        before = stats_rollup.truck_state(db_truck)
+        before_key = natural_key(db_truck)
+        update_data = truck.dict(exclude_unset=True)
+        for key, value in update_data.items():
+            setattr(db_truck, key, value)
+        
+        db_truck.updated_at = datetime.utcnow()
+        db_truck.row_version = next_version(db)
+        stats_rollup.record_change(db, before=before, after=stats_rollup.truck_state(db_truck))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail="Another truck already exists with the same date, terminal, shipping no, dock code and route"
+            )
+        db.refresh(db_truck)
+        duplicate_index.apply(removed=[before_key], added=[natural_key(db_truck)])
+        return db_truck
     
-    db_truck.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(db_truck)
+    db_truck = await run_db(apply_update)
+    response_cache.invalidate()
     
-    await manager.broadcast({
-        "type": "truck_updated",
-        "data": {
-            "id": db_truck.id,
-            "terminal": db_truck.terminal,
-            "shipping_no": db_truck.shipping_no,
-            "dock_code": db_truck.dock_code,
-            "truck_route": db_truck.truck_route,
-            "preparation_start": db_truck.preparation_start,
-            "preparation_end": db_truck.preparation_end,
-            "loading_start": db_truck.loading_start,
-            "loading_end": db_truck.loading_end,
-            "status_preparation": db_truck.status_preparation,
-            "status_loading": db_truck.status_loading,
-            "created_at": db_truck.created_at.isoformat(),
-            "updated_at": db_truck.updated_at.isoformat() if db_truck.updated_at else None
-        }
-    })
+    truck_data = truck_to_dict(db_truck)
+    await manager.broadcast({"type": "truck_updated", "data": truck_data})
     
-    return db_truck
+    return FastJSONResponse(truck_data)
 
 @app.delete("/api/trucks/{truck_id}")
 async def delete_truck(
     truck_id: str,
-    current_user: UserResponse = Depends(check_permission("admin")),
-    db: Session = Depends(get_db)
+    current_user: UserResponse = Depends(check_permission("admin"))
 ):
-    db_truck = db.query(Truck).filter(Truck.id == truck_id).first()
-    if not db_truck:
-        raise HTTPException(status_code=404, detail="Truck not found")
+    def apply_delete(db: Session):
+        db_truck = db.query(Truck).filter(Truck.id == truck_id).first()
+        if not db_truck:
+            raise HTTPException(status_code=404, detail="Truck not found")
+        
+        stats_rollup.record_change(db, before=stats_rollup.truck_state(db_truck))
+        removed_key = natural_key(db_truck)
+        record_delete(db, db_truck.id, next_version(db))
+        db.delete(db_truck)
+        db.commit()
+        duplicate_index.apply(removed=[removed_key])
     
-    db.delete(db_truck)
-    db.commit()
+    await run_db(apply_delete)
+    response_cache.invalidate()
     
     await manager.broadcast({
         "type": "truck_deleted",
@@ -1376,8 +1210,7 @@ async def update_truck_status(
     truck_id: str,
     status_type: str,
     status: str,
-    current_user: UserResponse = Depends(check_permission("user")),
-    db: Session = Depends(get_db)
+    current_user: UserResponse = Depends(check_permission("user"))
 ):
     if status_type not in ["preparation", "loading"]:
         raise HTTPException(status_code=400, detail="Invalid status type")
@@ -1385,41 +1218,68 @@ async def update_truck_status(
     if status not in ["On Process", "Delay", "Finished"]:
         raise HTTPException(status_code=400, detail="Invalid status value")
     
-    db_truck = db.query(Truck).filter(Truck.id == truck_id).first()
-    if not db_truck:
-        raise HTTPException(status_code=404, detail="Truck not found")
+    def apply_status(db: Session):
+        db_truck = db.query(Truck).filter(Truck.id == truck_id).first()
+        if not db_truck:
+            raise HTTPException(status_code=404, detail="Truck not found")
+        
+        before = stats_rollup.truck_state(db_truck)
+        if status_type == "preparation":
+            db_truck.status_preparation = status
+        else:
+            db_truck.status_loading = status
+        
+        db_truck.updated_at = datetime.utcnow()
+        db_truck.row_version = next_version(db)
+        stats_rollup.record_change(db, before=before, after=stats_rollup.truck_state(db_truck))
+        db.commit()
+        db.refresh(db_truck)
+        return db_truck
     
-    if status_type == "preparation":
-        db_truck.status_preparation = status
-    else:
-        db_truck.status_loading = status
+    db_truck = await run_db(apply_status)
+    response_cache.invalidate()
     
-    db_truck.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(db_truck)
+    truck_data = truck_to_dict(db_truck)
+    await manager.broadcast({"type": "status_updated", "data": truck_data})
     
-    await manager.broadcast({
-        "type": "status_updated",
-        "data": {
-            "id": db_truck.id,
-            "terminal": db_truck.terminal,
-            "shipping_no": db_truck.shipping_no,
-            "dock_code": db_truck.dock_code,
-            "truck_route": db_truck.truck_route,
-            "preparation_start": db_truck.preparation_start,
-            "preparation_end": db_truck.preparation_end,
-            "loading_start": db_truck.loading_start,
-            "loading_end": db_truck.loading_end,
-            "status_preparation": db_truck.status_preparation,
-            "status_loading": db_truck.status_loading,
-            "created_at": db_truck.created_at.isoformat(),
-            "updated_at": db_truck.updated_at.isoformat() if db_truck.updated_at else None
+    return FastJSONResponse(truck_data)
+@app.post("/api/admin/stats/rebuild")
+def rebuild_stats_rollup(
+    current_user: UserResponse = Depends(check_permission("admin")),
+    db: Session = Depends(get_db)
+):
+    """Recompute the daily stats rollup from the trucks table (admin only)"""
+    try:
+        rows = stats_rollup.rebuild_rollup(db)
+        response_cache.invalidate()
+        shared_state.publish("invalidate", {"reason": "stats_rebuild"})
+        return {
+            "success": True,
+            "rollup_rows": rows,
+            "message": f"Rebuilt truck_daily_stats with {rows} (day, terminal) rows"
         }
-    })
-    
-    return db_truck
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild stats rollup: {str(e)}")
+
+@app.post("/api/admin/duplicate-index/rebuild")
+def rebuild_duplicate_index(
+    current_user: UserResponse = Depends(check_permission("admin")),
+    db: Session = Depends(get_db)
+):
+    """Reload the in-memory duplicate index on every worker (admin only)"""
+    try:
+        duplicate_index.rebuild(db)
+        shared_state.publish("invalidate", {"reason": "duplicate_index_rebuild"})
+        return {
+            "success": True,
+            "duplicate_index": duplicate_index.stats(),
+            "message": "Duplicate index rebuilt"
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild duplicate index: {str(e)}")
+
 @app.get("/api/debug/trucks")
-async def debug_trucks(
+def debug_trucks(
     current_user: UserResponse = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -1,9 +1,12 @@
 # backend/app/models.py - Updated schema for better monthly data support
 
-from sqlalchemy import Column, String, DateTime, Date, create_engine, Index
+from sqlalchemy import Column, String, DateTime, Date, Integer, create_engine, Index, event, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import IntegrityError, OperationalError
+from .executor import run_blocking
+from datetime import datetime
 import uuid
 import os
 
@@ -25,14 +28,60 @@ class Truck(Base):
     status_loading = Column(String(20), default="On Process", index=True)     # Added index
     created_at = Column(DateTime, default=func.now(), index=True)  # Added index for date filtering
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    record_date = Column(Date, default=func.current_date())  # date(created_at), kept in sync on write
+    row_version = Column(Integer, nullable=False, default=0, index=True)  # dataset version of the last write
     
     # Add composite index for common query patterns
     __table_args__ = (
         Index('idx_terminal_date', 'terminal', 'created_at'),
         Index('idx_shipping_date', 'shipping_no', 'created_at'),
         Index('idx_status_date', 'status_preparation', 'status_loading', 'created_at'),
+        Index('idx_created_id', 'created_at', 'id'),  # Keyset pagination order
+        # Natural key: one truck per day/terminal/shipping/dock/route
+        Index('uq_truck_natural_key', 'record_date', 'terminal', 'shipping_no', 'dock_code', 'truck_route', unique=True),
     )
 
+# Fallback when existing data already holds natural-key duplicates
+NATURAL_KEY_FALLBACK_INDEX = "idx_truck_natural_key"
+
+@event.listens_for(Truck, "before_insert")
+@event.listens_for(Truck, "before_update")
+def sync_record_date(mapper, connection, target):
+    """ORM writes derive record_date from created_at (bulk inserts set it explicitly)"""
+    if isinstance(target.created_at, datetime):
+        target.record_date = target.created_at.date()
+
+class DatasetVersion(Base):
+    """Single-row counter bumped by every truck write transaction (change feed)"""
+    __tablename__ = "dataset_version"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    pruned_through = Column(Integer, nullable=False, default=0)  # tombstones up to this version are gone
+    modified_at = Column(DateTime, nullable=True)  # when version last changed (Last-Modified)
+
+class TruckTombstone(Base):
+    """Deleted trucks, kept so change feed clients can drop them"""
+    __tablename__ = "truck_tombstones"
+    
+    truck_id = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, index=True)
+    deleted_at = Column(DateTime, default=func.now())
+
+class TruckDailyStats(Base):
+    """Per-day, per-terminal status counters maintained on every truck write"""
+    __tablename__ = "truck_daily_stats"
+    
+    day = Column(Date, primary_key=True)
+    terminal = Column(String(50), primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+    prep_on_process = Column(Integer, nullable=False, default=0)
+    prep_delay = Column(Integer, nullable=False, default=0)
+    prep_finished = Column(Integer, nullable=False, default=0)
+    load_on_process = Column(Integer, nullable=False, default=0)
+    load_delay = Column(Integer, nullable=False, default=0)
+    load_finished = Column(Integer, nullable=False, default=0)
+
 class User(Base):
     __tablename__ = "users"
     
@@ -44,15 +93,184 @@ class User(Base):
 
 # Database setup - Use data directory for persistence
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/truck_management.db")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+IS_SQLITE_MEMORY = IS_SQLITE and (":memory:" in DATABASE_URL or DATABASE_URL.rstrip("/") in ("sqlite:", "sqlite+pysqlite:"))
+
+# SQLite profile applied to every new connection. WAL lets readers keep going
+# while an import holds the write lock; busy_timeout makes the other gunicorn
+# workers wait for that lock instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    # First, so the pragmas after it wait for other workers' locks too
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000")),
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative = KiB
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+# Connection pool per worker process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+
+def engine_options():
+    """Explicit pool settings; in-memory SQLite keeps SQLAlchemy's single-connection pool"""
+    if IS_SQLITE_MEMORY:
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": not IS_SQLITE,
+    }
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            if name == "journal_mode":
+                if IS_SQLITE_MEMORY:
+                    continue
+                # The mode is stored in the file; switching needs an exclusive lock, so only
+                # the first connection after a change does it
+                cursor.execute("PRAGMA journal_mode")
+                if cursor.fetchone()[0].lower() == str(value).lower():
+                    continue
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if IS_SQLITE else {}, **engine_options())
+if IS_SQLITE:
+    event.listen(engine, "connect", apply_sqlite_pragmas)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine (DB_ASYNC=true): same database through aiosqlite / asyncpg.
+# Schema setup and scripts keep using the sync engine above.
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+def async_database_url(url: str) -> str:
+    """Swap the sync driver in DATABASE_URL for its async counterpart"""
+    scheme, rest = url.split("://", 1)
+    dialect = scheme.split("+", 1)[0]
+    if dialect not in ASYNC_DRIVERS:
+        raise RuntimeError(f"DB_ASYNC is not supported for database URL scheme: {scheme}")
+    return f"{ASYNC_DRIVERS[dialect]}://{rest}"
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    async_engine = create_async_engine(async_database_url(DATABASE_URL), **engine_options())
+    if IS_SQLITE:
+        event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Create data directory if it doesn't exist
 os.makedirs("./data", exist_ok=True)
 
+# Add and backfill trucks.record_date on databases created before it existed
+def migrate_record_date():
+    columns = {column["name"] for column in inspect(engine).get_columns("trucks")}
+    if "record_date" in columns:
+        return
+    try:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ALTER TABLE trucks ADD COLUMN record_date DATE")
+            result = conn.exec_driver_sql(
+                "UPDATE trucks SET record_date = date(created_at) WHERE created_at IS NOT NULL"
+            )
+        print(f"✅ Added trucks.record_date and backfilled {result.rowcount} rows")
+    except OperationalError as e:
+        # Another worker migrated first
+        if "duplicate column" not in str(e).lower():
+            raise
+
+def migrate_row_version():
+    columns = {column["name"] for column in inspect(engine).get_columns("trucks")}
+    if "row_version" not in columns:
+        try:
+            with engine.begin() as conn:
+                # Existing rows become version 1 so a client syncing from 0 receives them
+                conn.exec_driver_sql("ALTER TABLE trucks ADD COLUMN row_version INTEGER NOT NULL DEFAULT 1")
+            print("✅ Added trucks.row_version")
+        except OperationalError as e:
+            if "duplicate column" not in str(e).lower():
+                raise
+    if "modified_at" not in {column["name"] for column in inspect(engine).get_columns("dataset_version")}:
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql("ALTER TABLE dataset_version ADD COLUMN modified_at DATETIME")
+        except OperationalError as e:
+            if "duplicate column" not in str(e).lower():
+                raise
+    try:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO dataset_version (id, version, pruned_through) "
+                "SELECT 1, COALESCE(MAX(row_version), 0), 0 FROM trucks "
+                "WHERE NOT EXISTS (SELECT 1 FROM dataset_version WHERE id = 1)"
+            )
+    except IntegrityError:
+        pass  # Another worker created the row first
+
+def create_if_missing(create):
+    """Run a CREATE TABLE/INDEX step; every worker runs these at boot, so losing the race is fine"""
+    try:
+        create()
+    except OperationalError as e:
+        # Another worker created it between the existence check and the CREATE
+        if "already exists" not in str(e).lower():
+            raise
+
+def create_natural_key_index(index):
+    """Unique natural-key index, or a plain one if existing rows already collide"""
+    try:
+        create_if_missing(lambda: index.create(bind=engine, checkfirst=True))
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {NATURAL_KEY_FALLBACK_INDEX}")
+    except IntegrityError:
+        columns = ", ".join(column.name for column in index.columns)
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {NATURAL_KEY_FALLBACK_INDEX} ON trucks ({columns})")
+        print(f"⚠️ Duplicate natural keys in trucks - created non-unique {NATURAL_KEY_FALLBACK_INDEX}; "
+              f"remove the duplicates and restart to enforce uniqueness")
+
 # Create tables
 def create_tables():
-    Base.metadata.create_all(bind=engine)
+    # Table by table, so a table another worker just created does not skip the rest
+    for table in Base.metadata.sorted_tables:
+        create_if_missing(lambda: table.create(bind=engine, checkfirst=True))
+    migrate_record_date()
+    migrate_row_version()
+    # Tables that already existed (or were created by another worker) still need their indexes
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if table is Truck.__table__ and index.unique:
+                create_natural_key_index(index)
+            else:
+                create_if_missing(lambda: index.create(bind=engine, checkfirst=True))
+
+# Effective connection settings, printed at startup
+def database_settings_report():
+    report = {
+        "url": engine.url.render_as_string(hide_password=True),
+        "pool": engine.pool.status(),
+    }
+    if IS_SQLITE:
+        with engine.connect() as conn:
+            for name in SQLITE_PRAGMAS:
+                report[name] = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+    return report
 
 # Get database session
 def get_db():
@@ -62,6 +280,37 @@ def get_db():
     finally:
         db.close()
 
+# Run func(session, *args) on the configured database layer
+async def run_db(func, *args, **kwargs):
+    """
+    With DB_ASYNC the function runs on an AsyncSession via run_sync, so its
+    queries await the async driver and other requests interleave on I/O.
+    Otherwise it gets a regular session on the blocking thread pool.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            return await session.run_sync(func, *args, **kwargs)
+    return await run_db_blocking(func, *args, **kwargs)
+
+# Run func(session, *args) with a sync session on the blocking thread pool
+async def run_db_blocking(func, *args, **kwargs):
+    """
+    For long CPU-heavy work (bulk imports, pruning): run_sync would execute
+    the Python side of it on the event loop even with DB_ASYNC.
+    """
+    def call():
+        db = SessionLocal()
+        try:
+            return func(db, *args, **kwargs)
+        finally:
+            db.close()
+
+    return await run_blocking(call)
+
+async def dispose_async_engine():
+    if async_engine is not None:
+        await async_engine.dispose()
+
 # Helper function to get password hash (moved from main.py for better organization)
 import bcrypt
 
@@ -0,0 +1,91 @@
+# backend/app/passwords.py - bcrypt hashing with a tunable cost and login limits
+#
+# Every check costs a full bcrypt round, so it runs on the dedicated password
+# pool (executor.PASSWORD_POOL_SIZE) instead of the threads serving trucks.
+# Hashes made with another cost than BCRYPT_ROUNDS are upgraded on login.
+
+import bcrypt
+import os
+
+from .executor import run_password_work
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Password checks in flight per username; further attempts get 429
+LOGIN_MAX_CONCURRENT_PER_USER = int(os.getenv("LOGIN_MAX_CONCURRENT_PER_USER", "2"))
+
+
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def check_password(plain_password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def hash_rounds(hashed_password: str):
+    """Cost factor of a $2b$12$... hash, or None if it cannot be read"""
+    try:
+        return int(hashed_password.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    return hash_rounds(hashed_password) != BCRYPT_ROUNDS
+
+
+def verify_and_rehash(plain_password: str, hashed_password: str):
+    """
+    Check a password and, when it matches a hash of another cost, hash it again
+    with BCRYPT_ROUNDS. Returns (matches, new_hash or None)
+    """
+    if not check_password(plain_password, hashed_password):
+        return False, None
+    if needs_rehash(hashed_password):
+        return True, hash_password(plain_password)
+    return True, None
+
+
+async def hash_password_async(password: str) -> str:
+    return await run_password_work(hash_password, password)
+
+
+async def verify_and_rehash_async(plain_password: str, hashed_password: str):
+    return await run_password_work(verify_and_rehash, plain_password, hashed_password)
+
+
+class LoginLimiter:
+    """Caps concurrent password checks per username (event-loop only, no locking)"""
+
+    def __init__(self, max_per_user: int = LOGIN_MAX_CONCURRENT_PER_USER):
+        self.max_per_user = max_per_user
+        self.in_flight = {}
+        self.rejected = 0
+        self.rehashed = 0
+
+    def try_acquire(self, username: str) -> bool:
+        count = self.in_flight.get(username, 0)
+        if self.max_per_user > 0 and count >= self.max_per_user:
+            self.rejected += 1
+            return False
+        self.in_flight[username] = count + 1
+        return True
+
+    def release(self, username: str):
+        count = self.in_flight.get(username, 0) - 1
+        if count > 0:
+            self.in_flight[username] = count
+        else:
+            self.in_flight.pop(username, None)
+
+    def stats(self):
+        return {
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "max_per_user": self.max_per_user,
+            "in_flight": sum(self.in_flight.values()),
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+        }
+
+
+login_limiter = LoginLimiter()
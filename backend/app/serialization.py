@@ -0,0 +1,67 @@
+# backend/app/serialization.py - Truck rows straight to JSON bytes
+#
+# List endpoints select plain column tuples and encode them with orjson, which
+# handles datetimes and None natively, instead of building dicts by hand,
+# walking them with clean_for_json and validating them again with pydantic.
+# Falls back to the json module when orjson is not installed.
+
+from fastapi.responses import Response
+from sqlalchemy import select
+import json
+
+from .models import Truck
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Output order of every truck payload (API responses and WebSocket messages)
+TRUCK_FIELDS = [
+    "id", "terminal", "shipping_no", "dock_code", "truck_route",
+    "preparation_start", "preparation_end", "loading_start", "loading_end",
+    "status_preparation", "status_loading", "created_at", "updated_at"
+]
+TRUCK_COLUMNS = [getattr(Truck, field) for field in TRUCK_FIELDS]
+
+
+def truck_select():
+    """Core select of the truck payload columns; rows come back as tuples"""
+    return select(*TRUCK_COLUMNS)
+
+
+def _default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def truck_rows(rows):
+    """Column tuples (from truck_select) as dicts; datetimes are left to dumps()"""
+    return [dict(zip(TRUCK_FIELDS, row)) for row in rows]
+
+
+def encode_truck_rows(rows) -> bytes:
+    return dumps(truck_rows(rows))
+
+
+def truck_to_dict(truck):
+    """JSON-ready payload of one truck (ORM object or row) - also used for WebSocket messages"""
+    data = {field: getattr(truck, field) for field in TRUCK_FIELDS}
+    data["created_at"] = truck.created_at.isoformat()
+    data["updated_at"] = truck.updated_at.isoformat() if truck.updated_at else None
+    return data
+
+
+class FastJSONResponse(Response):
+    """JSONResponse rendered with dumps(); returning it skips response_model validation"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,482 @@
+# backend/app/shared_state.py - State shared between gunicorn workers
+#
+# Import sessions and the WebSocket fan-out channel must be visible to every
+# worker process. Two backends are available:
+#   - sqlite (default): a small side database next to truck_management.db
+#   - redis: any Redis-compatible server (requires the `redis` package)
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+import zlib
+
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "sqlite").lower()
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "./data/shared_state.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+IMPORT_SESSION_TTL_SECONDS = int(os.getenv("IMPORT_SESSION_TTL_SECONDS", "3600"))
+SHARED_STATE_POLL_INTERVAL = float(os.getenv("SHARED_STATE_POLL_INTERVAL", "0.25"))
+# Backoff between Redis pub/sub reconnect attempts
+REDIS_RECONNECT_MIN_SECONDS = 1
+REDIS_RECONNECT_MAX_SECONDS = 30
+IMPORT_JOB_RETENTION_SECONDS = int(os.getenv("IMPORT_JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+# Import session limits: total stored bytes (compressed), sessions per user,
+# and how often each worker sweeps expired sessions
+IMPORT_SESSION_MAX_BYTES = int(os.getenv("IMPORT_SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+IMPORT_SESSION_MAX_PER_USER = int(os.getenv("IMPORT_SESSION_MAX_PER_USER", "5"))
+IMPORT_SESSION_SWEEP_INTERVAL = float(os.getenv("IMPORT_SESSION_SWEEP_INTERVAL", "60"))
+
+# Published events are only needed until every worker has polled them
+EVENT_RETENTION_SECONDS = 60
+
+# Identifies this process so it can skip its own published events
+WORKER_ID = uuid.uuid4().hex
+
+
+def pack_session(data: dict) -> bytes:
+    """Import sessions are stored as compressed compact JSON (templates repeat heavily)"""
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+
+def unpack_session(payload):
+    try:
+        return json.loads(zlib.decompress(payload))
+    except (zlib.error, TypeError):
+        return json.loads(payload)  # stored before sessions were compressed
+
+
+class SessionTooLarge(ValueError):
+    pass
+
+
+class SessionStoreMetrics:
+    """Eviction counters kept by each worker for the sessions it removed"""
+
+    def __init__(self):
+        self.evictions = {"expired": 0, "lru": 0, "quota": 0}
+        self.rejected = 0
+
+    def evicted(self, reason: str, count: int = 1):
+        self.evictions[reason] += count
+
+    def as_dict(self, live_sessions: int, bytes_held: int):
+        return {
+            "live_sessions": live_sessions,
+            "bytes_held": bytes_held,
+            "max_bytes": IMPORT_SESSION_MAX_BYTES,
+            "max_per_user": IMPORT_SESSION_MAX_PER_USER,
+            "ttl_seconds": IMPORT_SESSION_TTL_SECONDS,
+            "evictions": dict(self.evictions),
+            "rejected": self.rejected,
+        }
+
+
+def check_session_size(metrics: SessionStoreMetrics, size: int):
+    if size > IMPORT_SESSION_MAX_BYTES:
+        metrics.rejected += 1
+        raise SessionTooLarge(
+            f"Import session too large ({size} bytes stored, limit {IMPORT_SESSION_MAX_BYTES})"
+        )
+
+
+async def run_session_sweeper(store, interval: float = IMPORT_SESSION_SWEEP_INTERVAL):
+    """Remove expired import sessions periodically, not only when a new preview arrives"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await asyncio.to_thread(store.sweep_sessions)
+            if removed:
+                print(f"🧹 Swept {removed} expired import sessions")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Import session sweep error: {e}")
+
+
+class SQLiteSharedState:
+    """Sessions and pub/sub events stored in a shared SQLite file"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SHARED_STATE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.session_metrics = SessionStoreMetrics()
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(import_sessions)")}
+            if columns and "size_bytes" not in columns:
+                # Sessions are short-lived previews; recreate rather than migrate
+                conn.execute("DROP TABLE import_sessions")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS import_sessions ("
+                " session_id TEXT PRIMARY KEY,"
+                " user_id TEXT,"
+                " payload BLOB NOT NULL,"
+                " size_bytes INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_import_sessions_user ON import_sessions (user_id, last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_import_sessions_access ON import_sessions (last_access)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS import_jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " payload TEXT NOT NULL,"
+                " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " channel TEXT NOT NULL,"
+                " origin TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    # Import sessions: TTL, per-user quota and a total size cap, evicting least recently used
+    def set_session(self, session_id: str, data: dict, ttl_seconds: int = IMPORT_SESSION_TTL_SECONDS):
+        payload = pack_session(data)
+        check_session_size(self.session_metrics, len(payload))
+        user_id = data.get("user_id")
+        now = time.time()
+
+        with self._connect() as conn:
+            self._sweep(conn, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO import_sessions"
+                " (session_id, user_id, payload, size_bytes, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, user_id, payload, len(payload), now + ttl_seconds, now)
+            )
+
+            if user_id and IMPORT_SESSION_MAX_PER_USER > 0:
+                over_quota = conn.execute(
+                    "SELECT session_id FROM import_sessions WHERE user_id = ?"
+                    " ORDER BY last_access DESC LIMIT -1 OFFSET ?",
+                    (user_id, IMPORT_SESSION_MAX_PER_USER)
+                ).fetchall()
+                self._delete(conn, [row[0] for row in over_quota], "quota")
+
+            total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM import_sessions").fetchone()[0]
+            if total > IMPORT_SESSION_MAX_BYTES:
+                evict = []
+                for other_id, size in conn.execute(
+                    "SELECT session_id, size_bytes FROM import_sessions WHERE session_id != ? ORDER BY last_access",
+                    (session_id,)
+                ):
+                    if total <= IMPORT_SESSION_MAX_BYTES:
+                        break
+                    evict.append(other_id)
+                    total -= size
+                self._delete(conn, evict, "lru")
+
+    def get_session(self, session_id: str):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload FROM import_sessions WHERE session_id = ? AND expires_at >= ?",
+                (session_id, now)
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE import_sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+        return unpack_session(row[0]) if row else None
+
+    def delete_session(self, session_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM import_sessions WHERE session_id = ?", (session_id,))
+
+    def _delete(self, conn, session_ids, reason: str):
+        if session_ids:
+            conn.executemany("DELETE FROM import_sessions WHERE session_id = ?", [(sid,) for sid in session_ids])
+            self.session_metrics.evicted(reason, len(session_ids))
+
+    def _sweep(self, conn, now: float) -> int:
+        removed = conn.execute("DELETE FROM import_sessions WHERE expires_at < ?", (now,)).rowcount
+        if removed:
+            self.session_metrics.evicted("expired", removed)
+        return removed
+
+    def sweep_sessions(self) -> int:
+        with self._connect() as conn:
+            return self._sweep(conn, time.time())
+
+    def session_stats(self):
+        with self._connect() as conn:
+            live, held = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM import_sessions WHERE expires_at >= ?",
+                (time.time(),)
+            ).fetchone()
+        return self.session_metrics.as_dict(live, held)
+
+    # Import jobs (state is written by the running worker only; cancel is a separate flag)
+    def set_job(self, job_id: str, data: dict):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM import_jobs WHERE updated_at < ?", (now - IMPORT_JOB_RETENTION_SECONDS,))
+            conn.execute(
+                "INSERT INTO import_jobs (job_id, payload, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(job_id) DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at",
+                (job_id, json.dumps(data), now)
+            )
+
+    def get_job(self, job_id: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT payload FROM import_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def request_job_cancel(self, job_id: str):
+        with self._connect() as conn:
+            conn.execute("UPDATE import_jobs SET cancel_requested = 1 WHERE job_id = ?", (job_id,))
+
+    def is_job_cancel_requested(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM import_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    # Pub/sub
+    def publish(self, channel: str, message: dict):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO events (channel, origin, payload, created_at) VALUES (?, ?, ?, ?)",
+                (channel, WORKER_ID, json.dumps(message), now)
+            )
+            conn.execute("DELETE FROM events WHERE created_at < ?", (now - EVENT_RETENTION_SECONDS,))
+
+    def _last_event_id(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def _events_after(self, last_id: int):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT id, channel, origin, payload FROM events WHERE id > ? ORDER BY id",
+                (last_id,)
+            ).fetchall()
+
+    async def listen(self, handler):
+        """Poll for events published by other workers and pass them to handler(channel, message)"""
+        last_id = await asyncio.to_thread(self._last_event_id)
+        while True:
+            try:
+                rows = await asyncio.to_thread(self._events_after, last_id)
+                for event_id, channel, origin, payload in rows:
+                    last_id = event_id
+                    if origin != WORKER_ID:
+                        await handler(channel, json.loads(payload))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Shared state listener error: {e}")
+            await asyncio.sleep(SHARED_STATE_POLL_INTERVAL)
+
+
+class RedisSharedState:
+    """Sessions as expiring keys and pub/sub on a Redis-compatible server"""
+
+    name = "redis"
+    key_prefix = "truck_management:"
+
+    def __init__(self, url: str = REDIS_URL):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise RuntimeError("SHARED_STATE_BACKEND=redis requires the 'redis' package (pip install redis)")
+
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+        self._async_redis = redis.asyncio
+        self.session_metrics = SessionStoreMetrics()
+
+        # Session index: LRU order, stored sizes, owners and per-user LRU order
+        self.sessions_lru = f"{self.key_prefix}sessions:lru"
+        self.sessions_size = f"{self.key_prefix}sessions:size"
+        self.sessions_owner = f"{self.key_prefix}sessions:owner"
+
+    def _session_key(self, session_id: str):
+        return f"{self.key_prefix}session:{session_id}"
+
+    def _user_sessions_key(self, user_id: str):
+        return f"{self.key_prefix}sessions:user:{user_id}"
+
+    # Import sessions: TTL via key expiry, quota and size cap via the session index
+    def set_session(self, session_id: str, data: dict, ttl_seconds: int = IMPORT_SESSION_TTL_SECONDS):
+        payload = pack_session(data)
+        check_session_size(self.session_metrics, len(payload))
+        user_id = data.get("user_id")
+        now = time.time()
+
+        self.sweep_sessions()
+        pipe = self.client.pipeline()
+        pipe.set(self._session_key(session_id), payload, ex=ttl_seconds)
+        pipe.zadd(self.sessions_lru, {session_id: now})
+        pipe.hset(self.sessions_size, session_id, len(payload))
+        if user_id:
+            pipe.hset(self.sessions_owner, session_id, user_id)
+            pipe.zadd(self._user_sessions_key(user_id), {session_id: now})
+        pipe.execute()
+
+        if user_id and IMPORT_SESSION_MAX_PER_USER > 0:
+            over_quota = self.client.zrange(self._user_sessions_key(user_id), 0, -(IMPORT_SESSION_MAX_PER_USER + 1))
+            self._delete([sid.decode() for sid in over_quota], "quota")
+
+        sizes = {sid.decode(): int(size) for sid, size in self.client.hgetall(self.sessions_size).items()}
+        total = sum(sizes.values())
+        if total > IMPORT_SESSION_MAX_BYTES:
+            evict = []
+            for sid in self.client.zrange(self.sessions_lru, 0, -1):
+                sid = sid.decode()
+                if total <= IMPORT_SESSION_MAX_BYTES:
+                    break
+                if sid != session_id:
+                    evict.append(sid)
+                    total -= sizes.get(sid, 0)
+            self._delete(evict, "lru")
+
+    def get_session(self, session_id: str):
+        payload = self.client.get(self._session_key(session_id))
+        if not payload:
+            return None
+        now = time.time()
+        owner = self.client.hget(self.sessions_owner, session_id)
+        pipe = self.client.pipeline()
+        pipe.zadd(self.sessions_lru, {session_id: now}, xx=True)
+        if owner:
+            pipe.zadd(self._user_sessions_key(owner.decode()), {session_id: now}, xx=True)
+        pipe.execute()
+        return unpack_session(payload)
+
+    def delete_session(self, session_id: str):
+        self._remove([session_id], delete_payload=True)
+
+    def _remove(self, session_ids, delete_payload: bool):
+        if not session_ids:
+            return
+        owners = self.client.hmget(self.sessions_owner, session_ids)
+        pipe = self.client.pipeline()
+        for session_id, owner in zip(session_ids, owners):
+            if delete_payload:
+                pipe.delete(self._session_key(session_id))
+            pipe.zrem(self.sessions_lru, session_id)
+            pipe.hdel(self.sessions_size, session_id)
+            pipe.hdel(self.sessions_owner, session_id)
+            if owner:
+                pipe.zrem(self._user_sessions_key(owner.decode()), session_id)
+        pipe.execute()
+
+    def _delete(self, session_ids, reason: str):
+        if session_ids:
+            self._remove(session_ids, delete_payload=True)
+            self.session_metrics.evicted(reason, len(session_ids))
+
+    def sweep_sessions(self) -> int:
+        """Drop index entries whose session key already expired"""
+        session_ids = [sid.decode() for sid in self.client.zrange(self.sessions_lru, 0, -1)]
+        if not session_ids:
+            return 0
+        pipe = self.client.pipeline()
+        for session_id in session_ids:
+            pipe.exists(self._session_key(session_id))
+        expired = [sid for sid, exists in zip(session_ids, pipe.execute()) if not exists]
+        self._remove(expired, delete_payload=False)
+        if expired:
+            self.session_metrics.evicted("expired", len(expired))
+        return len(expired)
+
+    def session_stats(self):
+        live = self.client.zcard(self.sessions_lru)
+        held = sum(int(size) for size in self.client.hvals(self.sessions_size))
+        return self.session_metrics.as_dict(live, held)
+
+    # Import jobs
+    def set_job(self, job_id: str, data: dict):
+        self.client.set(f"{self.key_prefix}job:{job_id}", json.dumps(data), ex=IMPORT_JOB_RETENTION_SECONDS)
+
+    def get_job(self, job_id: str):
+        payload = self.client.get(f"{self.key_prefix}job:{job_id}")
+        return json.loads(payload) if payload else None
+
+    def request_job_cancel(self, job_id: str):
+        self.client.set(f"{self.key_prefix}job_cancel:{job_id}", 1, ex=IMPORT_JOB_RETENTION_SECONDS)
+
+    def is_job_cancel_requested(self, job_id: str) -> bool:
+        return bool(self.client.exists(f"{self.key_prefix}job_cancel:{job_id}"))
+
+    # Pub/sub
+    def publish(self, channel: str, message: dict):
+        envelope = json.dumps({"origin": WORKER_ID, "message": message})
+        self.client.publish(f"{self.key_prefix}{channel}", envelope)
+
+    async def listen(self, handler):
+        """
+        Subscribe to every channel and pass other workers' events to handler(channel, message).
+        Reconnects with backoff when the connection drops; pub/sub does not replay what was
+        published meanwhile, so every reconnect is followed by handler("resync", {}).
+        """
+        delay = REDIS_RECONNECT_MIN_SECONDS
+        subscribed_before = False
+        while True:
+            client = self._async_redis.Redis.from_url(self.url)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.psubscribe(f"{self.key_prefix}*")
+                if subscribed_before:
+                    print("🔗 Shared state listener reconnected")
+                    await self._dispatch(handler, "resync", {})
+                subscribed_before = True
+                delay = REDIS_RECONNECT_MIN_SECONDS
+
+                async for item in pubsub.listen():
+                    if item.get("type") != "pmessage":
+                        continue
+                    try:
+                        channel = item["channel"].decode().replace(self.key_prefix, "", 1)
+                        envelope = json.loads(item["data"])
+                    except Exception as e:
+                        print(f"❌ Shared state listener error: {e}")
+                        continue
+                    if envelope.get("origin") != WORKER_ID:
+                        await self._dispatch(handler, channel, envelope["message"])
+                raise ConnectionError("pub/sub connection closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Shared state listener disconnected: {e}; reconnecting in {delay:g}s")
+            finally:
+                try:
+                    await pubsub.close()
+                    await client.close()
+                except Exception:
+                    pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, REDIS_RECONNECT_MAX_SECONDS)
+
+    @staticmethod
+    async def _dispatch(handler, channel: str, message: dict):
+        try:
+            await handler(channel, message)
+        except Exception as e:
+            print(f"❌ Shared state listener error: {e}")
+
+
+def create_shared_state():
+    if SHARED_STATE_BACKEND == "redis":
+        return RedisSharedState()
+    if SHARED_STATE_BACKEND != "sqlite":
+        raise RuntimeError(f"Unknown SHARED_STATE_BACKEND: {SHARED_STATE_BACKEND}")
+    return SQLiteSharedState()
+
+
+shared_state = create_shared_state()
@@ -0,0 +1,175 @@
+# backend/app/stats_rollup.py - Incrementally maintained daily stats rollup
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.orm import Session
+from datetime import date, datetime
+
+from .models import Truck, TruckDailyStats
+from .change_feed import next_version
+
+STATUS_VALUES = ["On Process", "Delay", "Finished"]
+
+PREP_COLUMNS = {
+    "On Process": "prep_on_process",
+    "Delay": "prep_delay",
+    "Finished": "prep_finished",
+}
+
+LOAD_COLUMNS = {
+    "On Process": "load_on_process",
+    "Delay": "load_delay",
+    "Finished": "load_finished",
+}
+
+COUNTER_COLUMNS = ["total"] + list(PREP_COLUMNS.values()) + list(LOAD_COLUMNS.values())
+
+
+def _as_date(value):
+    """func.date() returns a string on SQLite and a date on Postgres"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def truck_state(truck):
+    """Snapshot the fields of a Truck (ORM object or dict) that feed the rollup"""
+    get = truck.get if isinstance(truck, dict) else lambda key: getattr(truck, key)
+    return (
+        _as_date(get('created_at')),
+        get('terminal'),
+        get('status_preparation'),
+        get('status_loading'),
+    )
+
+
+def add_to_deltas(deltas: dict, state, sign: int = 1, count: int = 1):
+    """Accumulate +/- counters for one truck state into {(day, terminal): {column: n}}"""
+    day, terminal, status_preparation, status_loading = state
+    counters = deltas.setdefault((day, terminal), dict.fromkeys(COUNTER_COLUMNS, 0))
+    counters["total"] += sign * count
+
+    prep_column = PREP_COLUMNS.get(status_preparation or "On Process")
+    if prep_column:
+        counters[prep_column] += sign * count
+
+    load_column = LOAD_COLUMNS.get(status_loading or "On Process")
+    if load_column:
+        counters[load_column] += sign * count
+
+
+def apply_deltas(db: Session, deltas: dict):
+    """
+    Apply accumulated deltas with atomic column increments.
+    Does not commit - callers apply deltas in the same transaction as the truck write.
+    """
+    for (day, terminal), counters in deltas.items():
+        if not any(counters.values()):
+            continue
+
+        result = db.execute(
+            update(TruckDailyStats)
+            .where(TruckDailyStats.day == day, TruckDailyStats.terminal == terminal)
+            .values({
+                column: getattr(TruckDailyStats, column) + value
+                for column, value in counters.items() if value
+            })
+        )
+        if result.rowcount == 0:
+            db.execute(insert(TruckDailyStats).values(day=day, terminal=terminal, **counters))
+
+
+def record_change(db: Session, before=None, after=None):
+    """Apply the rollup change for a single truck going from `before` to `after` state"""
+    deltas = {}
+    if before is not None:
+        add_to_deltas(deltas, before, sign=-1)
+    if after is not None:
+        add_to_deltas(deltas, after, sign=1)
+    apply_deltas(db, deltas)
+
+
+def rebuild_rollup(db: Session):
+    """Recompute the whole rollup from the trucks table (drift repair)"""
+    day_column = Truck.record_date
+    groups = db.query(
+        day_column.label('day'),
+        Truck.terminal,
+        Truck.status_preparation,
+        Truck.status_loading,
+        func.count(Truck.id).label('count')
+    ).group_by(
+        day_column,
+        Truck.terminal,
+        Truck.status_preparation,
+        Truck.status_loading
+    ).all()
+
+    deltas = {}
+    for group in groups:
+        state = (_as_date(group.day), group.terminal, group.status_preparation, group.status_loading)
+        add_to_deltas(deltas, state, count=group.count)
+
+    try:
+        db.query(TruckDailyStats).delete()
+        # New dataset version so /api/stats ETags held by clients stop matching
+        next_version(db)
+        if deltas:
+            db.execute(insert(TruckDailyStats), [
+                {"day": day, "terminal": terminal, **counters}
+                for (day, terminal), counters in deltas.items()
+            ])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return len(deltas)
+
+
+def ensure_rollup(db: Session):
+    """Build the rollup once for databases created before it existed"""
+    if db.query(TruckDailyStats.day).first() is None and db.query(Truck.id).first() is not None:
+        rows = rebuild_rollup(db)
+        print(f"📊 Built truck_daily_stats rollup ({rows} rows)")
+
+
+def query_stats(db: Session, terminal=None, from_date=None, to_date=None):
+    """Answer /api/stats by summing rollup rows per terminal"""
+    query = db.query(
+        TruckDailyStats.terminal,
+        *[func.sum(getattr(TruckDailyStats, column)).label(column) for column in COUNTER_COLUMNS]
+    )
+
+    if terminal:
+        query = query.filter(TruckDailyStats.terminal == terminal)
+    if from_date:
+        query = query.filter(TruckDailyStats.day >= from_date)
+    if to_date:
+        query = query.filter(TruckDailyStats.day <= to_date)
+
+    rows = query.group_by(TruckDailyStats.terminal).all()
+
+    total_trucks = 0
+    preparation_stats = dict.fromkeys(STATUS_VALUES, 0)
+    loading_stats = dict.fromkeys(STATUS_VALUES, 0)
+    terminal_stats = {}
+
+    for row in rows:
+        if not row.total:
+            continue
+        total_trucks += row.total
+        for status, column in PREP_COLUMNS.items():
+            preparation_stats[status] += getattr(row, column) or 0
+        for status, column in LOAD_COLUMNS.items():
+            loading_stats[status] += getattr(row, column) or 0
+        term = row.terminal or "Unknown"
+        terminal_stats[term] = terminal_stats.get(term, 0) + row.total
+
+    return {
+        "total_trucks": total_trucks,
+        "preparation_stats": preparation_stats,
+        "loading_stats": loading_stats,
+        "terminal_stats": terminal_stats
+    }
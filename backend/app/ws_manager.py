@@ -0,0 +1,200 @@
+# backend/app/ws_manager.py - WebSocket fan-out with per-client send queues
+
+from fastapi import WebSocket
+from typing import Dict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import asyncio
+import json
+import time
+import os
+
+from .shared_state import shared_state
+from .executor import run_blocking
+
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "5"))
+# Coalesce broadcasts arriving within this window (0 disables windowing)
+WS_BATCH_WINDOW_MS = int(os.getenv("WS_BATCH_WINDOW_MS", "0"))
+# Bulk messages list individual ids only up to this many changes
+WS_BULK_MAX_IDS = int(os.getenv("WS_BULK_MAX_IDS", "500"))
+
+BULK_EVENT_COUNTERS = {
+    "truck_created": "created",
+    "truck_updated": "updated",
+    "status_updated": "updated",
+    "truck_deleted": "deleted",
+}
+
+# Events collected by the manager.batch() block of the current task
+_current_batch: ContextVar = ContextVar("broadcast_batch", default=None)
+
+# Sent in place of a backlog that overflowed; clients should refetch
+RESYNC_MESSAGE = json.dumps({"type": "resync"})
+
+
+class ClientConnection:
+    """One socket with its own bounded queue and drain task"""
+
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+
+
+class ConnectionManager:
+    def __init__(self, queue_size: int = WS_SEND_QUEUE_SIZE, send_timeout: float = WS_SEND_TIMEOUT_SECONDS):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.batch_window = WS_BATCH_WINDOW_MS / 1000
+        self._window_events = []
+        self._window_task = None
+
+        # Metrics
+        self.messages_sent = 0
+        self.messages_coalesced = 0
+        self.clients_reaped = 0
+        self.send_latency_total = 0.0
+        self.send_latency_max = 0.0
+
+    @property
+    def active_connections(self):
+        return list(self.clients)
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        client = ClientConnection(websocket, self.queue_size)
+        self.clients[websocket] = client
+        client.task = asyncio.create_task(self._drain(client))
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client and client.task and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    async def broadcast(self, message: dict):
+        """Queue for this worker's clients and fan out to the other workers"""
+        batch = _current_batch.get()
+        if batch is not None:
+            batch.append(message)
+            return
+
+        if self.batch_window > 0:
+            self._window_events.append(message)
+            if self._window_task is None:
+                self._window_task = asyncio.create_task(self._flush_window())
+            return
+
+        await self._publish(message)
+
+    @asynccontextmanager
+    async def batch(self, source: str):
+        """Merge every broadcast made inside the block into one trucks_bulk_changed message"""
+        events = []
+        token = _current_batch.set(events)
+        try:
+            yield events
+        finally:
+            _current_batch.reset(token)
+            if events:
+                await self._publish(build_bulk_message(events, source))
+
+    async def notify(self, message: dict):
+        """
+        Publish right away, bypassing batches and the coalescing window (job progress).
+        Goes out on the "notify" channel, so other workers only relay it and keep their caches
+        """
+        await self._publish(message, "notify")
+
+    async def _flush_window(self):
+        await asyncio.sleep(self.batch_window)
+        events, self._window_events = self._window_events, []
+        self._window_task = None
+        if len(events) == 1:
+            await self._publish(events[0])
+        elif events:
+            await self._publish(build_bulk_message(events, "window"))
+
+    async def _publish(self, message: dict, channel: str = "broadcast"):
+        self.send_local(message)
+        try:
+            await run_blocking(shared_state.publish, channel, message)
+        except Exception as e:
+            print(f"❌ Shared state publish error: {e}")
+
+    def send_local(self, message: dict):
+        """Serialize once and hand the payload to every client queue without waiting"""
+        payload = json.dumps(message)
+        for client in list(self.clients.values()):
+            self._enqueue(client, payload)
+
+    def _enqueue(self, client: ClientConnection, payload: str):
+        try:
+            client.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # Slow consumer: collapse its backlog into a single resync message
+            dropped = 0
+            while not client.queue.empty():
+                client.queue.get_nowait()
+                dropped += 1
+            self.messages_coalesced += dropped + 1
+            client.queue.put_nowait(RESYNC_MESSAGE)
+
+    async def _drain(self, client: ClientConnection):
+        try:
+            while True:
+                payload = await client.queue.get()
+                started = time.perf_counter()
+                await asyncio.wait_for(client.websocket.send_text(payload), timeout=self.send_timeout)
+                elapsed = time.perf_counter() - started
+
+                self.messages_sent += 1
+                self.send_latency_total += elapsed
+                self.send_latency_max = max(self.send_latency_max, elapsed)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Dead or stalled socket - reap it so it stops accumulating messages
+            print(f"🔌 Dropping WebSocket client: {type(e).__name__} {e}")
+            self.clients_reaped += 1
+            self.disconnect(client.websocket)
+            try:
+                await client.websocket.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        depths = [client.queue.qsize() for client in self.clients.values()]
+        return {
+            "connections": len(self.clients),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "queue_size": self.queue_size,
+            "messages_sent": self.messages_sent,
+            "messages_coalesced": self.messages_coalesced,
+            "clients_reaped": self.clients_reaped,
+            "send_latency_avg_ms": round(self.send_latency_total / self.messages_sent * 1000, 3) if self.messages_sent else 0.0,
+            "send_latency_max_ms": round(self.send_latency_max * 1000, 3),
+        }
+
+
+def build_bulk_message(events, source: str):
+    """Summarize many truck events as a single trucks_bulk_changed message"""
+    counts = {"created": 0, "updated": 0, "deleted": 0}
+    ids = {}
+    for event in events:
+        counter = BULK_EVENT_COUNTERS.get(event.get("type"))
+        if counter:
+            counts[counter] += 1
+        truck_id = (event.get("data") or {}).get("id")
+        if truck_id:
+            ids[truck_id] = None
+
+    data = {"source": source, **counts, "total": len(ids)}
+    if len(ids) <= WS_BULK_MAX_IDS:
+        data["ids"] = list(ids)
+    else:
+        data["ids_truncated"] = True
+
+    return {"type": "trucks_bulk_changed", "data": data}
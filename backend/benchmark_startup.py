@@ -0,0 +1,69 @@
+# backend/benchmark_startup.py
+"""
+Measure what a fresh API worker pays to import app.main: wall time, peak RSS
+and which heavy libraries it loads. Each run is a new interpreter against a
+throwaway database, like a gunicorn worker booting.
+
+    python benchmark_startup.py               # app.main as it is
+    python benchmark_startup.py --preload pandas   # plus pandas, for comparison
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ["pandas", "numpy", "openpyxl", "xlsxwriter", "orjson"]
+
+CHILD_SCRIPT = """
+import json, resource, sys, time
+started = time.perf_counter()
+for name in {preload!r}:
+    __import__(name)
+import app.main
+elapsed = time.perf_counter() - started
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_mb": rss_kb / 1024 if sys.platform != "darwin" else rss_kb / 1024 / 1024,
+    "loaded": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def run_once(preload, workdir):
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    env["SHARED_STATE_PATH"] = os.path.join(workdir, "shared_state.db")
+    script = CHILD_SCRIPT.format(preload=preload, heavy=HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True
+    )
+    # app.main prints startup messages; the measurement is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API worker import time and memory")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--preload", action="append", default=[], help="module imported before app.main")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        run_once(args.preload, workdir)  # creates tables and the admin user
+        results = [run_once(args.preload, workdir) for _ in range(args.runs)]
+
+    seconds = [result["seconds"] for result in results]
+    rss = [result["max_rss_mb"] for result in results]
+    print(f"📊 import app.main ({args.runs} runs{', preload ' + ', '.join(args.preload) if args.preload else ''})")
+    print(f"   time:    median {statistics.median(seconds) * 1000:.0f} ms, min {min(seconds) * 1000:.0f} ms")
+    print(f"   max RSS: median {statistics.median(rss):.1f} MB")
+    print(f"   heavy modules loaded: {', '.join(results[-1]['loaded']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+# backend/rebuild_stats_rollup.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.models import SessionLocal, create_tables
+from app.stats_rollup import rebuild_rollup
+
+def main():
+    """Recompute truck_daily_stats from the trucks table"""
+    create_tables()
+    db = SessionLocal()
+    
+    try:
+        rows = rebuild_rollup(db)
+        print(f"✅ Rebuilt truck_daily_stats: {rows} (day, terminal) rows")
+    except Exception as e:
+        print(f"❌ Error rebuilding stats rollup: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()